@@ -0,0 +1,4 @@
+"""
+    Catalog benchmarks.
+    Run from the project folder, e.g. python -m benchmarks.query_plans
+"""
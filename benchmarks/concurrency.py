@@ -0,0 +1,203 @@
+"""
+    Concurrency ceiling of the read routes: the WSGI server against the
+    gevent read API.
+
+    python -m benchmarks.concurrency [--items 20000] [--levels 10,100,500]
+
+    A generated catalog is served by serve.py and by serve_reads.py. At
+    each level that many clients, each on a kept-alive connection, request
+    the JSON and Atom read routes for --duration seconds. A server's
+    ceiling is the highest level it serves without errors and with a p99
+    latency under --max-p99 milliseconds. Needs gevent, for the read API
+    server and for the clients.
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+from benchmarks.routes import build, summary
+from werkzeug.urls import url_quote
+import argparse
+import gevent
+import httplib
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Read routes of both servers, filled in like those of benchmarks.routes
+READ_ROUTES = [
+    '/item/%(item)s/json',
+    '/category/%(category)s/json',
+    '/catalog/json?limit=10',
+    '/catalog/recent.atom',
+]
+
+# Settings written for the benchmarked servers
+SETTINGS = """
+DATABASE_URI = 'sqlite:///%(folder)s/bench.db'
+SESSION_DATABASE_URI = 'sqlite:///%(folder)s/sessions.db'
+TEMPLATE_CACHE_FOLDER = '%(folder)s/template_cache'
+UPLOAD_FOLDER = '%(folder)s/uploads'
+CACHE_TYPE = 'null'
+"""
+
+# Seconds a client waits for a response before counting an error
+REQUEST_TIMEOUT = 10
+
+
+def read_urls(engine, rng, samples):
+    """ Return samples URLs of the read routes """
+    categories = [row[0] for row in engine.execute('SELECT name FROM category')]
+    items = [row[0] for row in engine.execute('SELECT name FROM item')]
+    return [rng.choice(READ_ROUTES) % {
+        'category': url_quote(rng.choice(categories)),
+        'item': url_quote(rng.choice(items))} for i in range(samples)]
+
+
+def start(command, port, settings):
+    """ Start a server script and wait until it accepts connections """
+    env = dict(os.environ, CATALOG_SETTINGS=settings,
+               PYTHONPATH=os.pathsep.join(
+                   filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, command[0]),
+         '--bind', '127.0.0.1:%d' % port] + command[1:],
+        cwd=os.path.dirname(settings), env=env)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return process
+        except socket.error:
+            if process.poll() is not None:
+                sys.exit('%s exited with %s' % (command[0], process.returncode))
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit('%s did not start' % command[0])
+
+
+def level(port, prefix, urls, clients, duration):
+    """ Keep clients connections busy for duration seconds, return the
+    latency summary, throughput and errors """
+    started = time.time()
+    deadline = started + duration
+    timings = []
+    errors = [0]
+
+    def client(number):
+        rng = random.Random(number)
+        connection = httplib.HTTPConnection('127.0.0.1', port,
+                                            timeout=REQUEST_TIMEOUT)
+        while time.time() < deadline:
+            url = prefix + rng.choice(urls)
+            sent = time.time()
+            # a kept-alive connection the server closed is retried once
+            for attempt in range(2):
+                try:
+                    connection.request('GET', url)
+                    response = connection.getresponse()
+                    response.read()
+                    ok = response.status == 200
+                    break
+                except (httplib.HTTPException, socket.error):
+                    connection.close()
+                    ok = False
+            if ok:
+                timings.append((time.time() - sent) * 1000)
+            else:
+                errors[0] += 1
+        connection.close()
+
+    gevent.joinall([gevent.spawn(client, n) for n in range(clients)])
+    # requests under way at the deadline are waited for
+    elapsed = time.time() - started
+    result = summary(timings) if timings else {
+        'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    result['throughput'] = round(len(timings) / elapsed, 1)
+    result['errors'] = errors[0]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--levels', default='10,100,500',
+                        help='comma separated numbers of clients')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds at each level')
+    parser.add_argument('--max-p99', type=float, default=1000,
+                        help='p99 milliseconds a server may take at its '
+                             'ceiling')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='serve.py worker processes')
+    parser.add_argument('--threads', type=int, default=2,
+                        help='serve.py threads per worker')
+    args = parser.parse_args()
+    levels = [int(clients) for clients in args.levels.split(',')]
+
+    folder = tempfile.mkdtemp()
+    servers = []
+    try:
+        settings = os.path.join(folder, 'settings.py')
+        with open(settings, 'w') as f:
+            f.write(SETTINGS % {'folder': folder})
+        # the application reads its settings when first imported
+        os.environ['CATALOG_SETTINGS'] = settings
+        from catalog import app, engine
+
+        build(engine, args, folder)
+        urls = read_urls(engine, random.Random(args.seed), 1000)
+        engine.dispose()
+
+        prefix = app.config['READ_API_PREFIX']
+        servers = [
+            ('wsgi', 8700, '', ['serve.py', '--workers', str(args.workers),
+                                '--threads', str(args.threads)]),
+            ('read api', 8701, prefix, ['serve_reads.py']),
+        ]
+        results = {}
+        for name, port, path, command in servers:
+            process = start(command, port, settings)
+            try:
+                results[name] = [level(port, path, urls, clients,
+                                       args.duration) for clients in levels]
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        shutil.rmtree(folder)
+
+    print('%d items, %d categories; serve.py with %d workers of %d threads' % (
+        args.items, args.categories, args.workers, args.threads))
+    print('%-10s %8s %10s %9s %9s %7s' % ('server', 'clients', 'requests/s',
+                                          'p50 ms', 'p99 ms', 'errors'))
+    for name, port, path, command in servers:
+        ceiling = 0
+        within = True
+        for clients, result in zip(levels, results[name]):
+            print('%-10s %8d %10.1f %9s %9s %7d' % (
+                name, clients, result['throughput'],
+                '%.2f' % result['p50_ms'] if result['p50_ms'] else '-',
+                '%.2f' % result['p99_ms'] if result['p99_ms'] else '-',
+                result['errors']))
+            within = within and not result['errors'] and \
+                result['p99_ms'] is not None and \
+                result['p99_ms'] <= args.max_p99
+            if within:
+                ceiling = clients
+        print('%-10s ceiling: %d clients' % (name, ceiling))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+    Generate a synthetic catalog as a JSON Lines file for
+    python manage.py import.
+
+    python -m benchmarks.generate items.jsonl [--items 100000]
+
+    Output is reproducible for a given seed. Items are spread over
+    categories and users with a Zipf-like skew, so a few categories and
+    users own most of the items, and some items reference images.
+"""
+
+from bisect import bisect
+from datetime import datetime, timedelta
+import argparse
+import json
+import random
+
+
+WORDS = ('barbell dumbbell cable kettlebell press curl row raise fly '
+         'squat lunge deadlift pull push dip extension incline decline '
+         'seated standing single arm leg chest back shoulder bicep tricep '
+         'grip wide narrow reverse hammer heavy light tempo pause').split()
+
+IMAGES = ('barbellcurl.jpg', 'barbellrow.jpg', 'benchpress.jpg',
+          'chestfly.jpg', 'deadlift.jpg', 'dip.png', 'dumbbellcurl.jpg',
+          'dumbbellraise.png', 'pullup.jpg', 'shoulderpress.png',
+          'squat.png', 'triceppushdown.jpg')
+
+
+class Skewed(object):
+    """ Picks 0..n-1, where value k has weight 1 / (k + 1) ** skew """
+
+    def __init__(self, rng, n, skew):
+        self.rng = rng
+        self.totals = []
+        total = 0.0
+        for k in range(n):
+            total += 1.0 / (k + 1) ** skew
+            self.totals.append(total)
+
+    def pick(self):
+        return bisect(self.totals, self.rng.random() * self.totals[-1])
+
+
+def generate(items, categories, users, skew=1.1, image_ratio=0.3, seed=1):
+    """ Yield item records in the bulk import format """
+    rng = random.Random(seed)
+    category = Skewed(rng, categories, skew)
+    user = Skewed(rng, users, skew)
+    start = datetime(2016, 1, 1)
+    for i in range(items):
+        words = [rng.choice(WORDS) for n in range(rng.randint(12, 60))]
+        yield {
+            'name': '%s %s %d' % (rng.choice(WORDS), rng.choice(WORDS), i),
+            'description': ' '.join(words).capitalize() + '.',
+            'category': 'Category %d' % category.pick(),
+            'image': (rng.choice(IMAGES)
+                      if rng.random() < image_ratio else None),
+            'user_email': 'user%d@example.com' % user.pick(),
+            'pub_date': (start + timedelta(seconds=i * 60 +
+                                           rng.randint(0, 59)))
+            .strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+
+def write(path, records):
+    """ Write records to a JSON Lines file """
+    with open(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('file')
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help='Zipf exponent of the category and user '
+                             'distributions')
+    parser.add_argument('--image-ratio', type=float, default=0.3,
+                        help='share of items with an image')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    write(args.file, generate(args.items, args.categories, args.users,
+                              args.skew, args.image_ratio, args.seed))
+
+
+if __name__ == '__main__':
+    main()
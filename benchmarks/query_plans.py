@@ -0,0 +1,109 @@
+"""
+    Compare query plans and timings of the hot catalog queries before and
+    after the lookup index migration, on a generated database.
+
+    python -m benchmarks.query_plans [--items 100000]
+"""
+
+from catalog import migrations
+from catalog.models import Base, User, Category, Item
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+
+# name, SQL, parameters
+QUERIES = [
+    ('latest items',
+     'SELECT id, name FROM item ORDER BY pub_date DESC LIMIT 10', {}),
+    ('category listing',
+     'SELECT id, name FROM item WHERE category_id = :category_id '
+     'ORDER BY pub_date DESC LIMIT 20', {'category_id': 7}),
+    ('items of a user',
+     'SELECT id, name FROM item WHERE user_id = :user_id', {'user_id': 11}),
+    ('categories of a user',
+     'SELECT id, name FROM category WHERE user_id = :user_id',
+     {'user_id': 11}),
+]
+
+NEW_INDEXES = ['ix_item_pub_date', 'ix_item_user_id', 'ix_category_user_id',
+               'ix_item_category_id_pub_date']
+
+
+def populate(engine, users, categories, items, batch=10000):
+    """ Fill the database with generated rows """
+    rng = random.Random(1610)
+    engine.execute(User.__table__.insert(), [
+        {'id': i, 'name': 'user %d' % i, 'email': 'user%d@example.com' % i}
+        for i in range(1, users + 1)])
+    engine.execute(Category.__table__.insert(), [
+        {'id': i, 'name': 'category %d' % i,
+         'user_id': rng.randint(1, users)}
+        for i in range(1, categories + 1)])
+    start = datetime(2016, 1, 1)
+    for offset in range(0, items, batch):
+        engine.execute(Item.__table__.insert(), [
+            {'id': i, 'name': 'item %d' % i,
+             'description': 'description of item %d' % i,
+             'pub_date': start + timedelta(minutes=rng.randint(0, 10 ** 6)),
+             'category_id': rng.randint(1, categories),
+             'user_id': rng.randint(1, users)}
+            for i in range(offset + 1, min(offset + batch, items) + 1)])
+
+
+def measure(engine, repeat):
+    """ Return (name, plan, median milliseconds) for every query """
+    results = []
+    for name, sql, params in QUERIES:
+        plan = '; '.join(row[3] for row in engine.execute(
+            text('EXPLAIN QUERY PLAN ' + sql), **params))
+        timings = []
+        for i in range(repeat):
+            started = time.time()
+            engine.execute(text(sql), **params).fetchall()
+            timings.append((time.time() - started) * 1000)
+        timings.sort()
+        results.append((name, plan, timings[len(timings) // 2]))
+    return results
+
+
+def report(title, results):
+    print(title)
+    for name, plan, elapsed in results:
+        print('  %-22s %9.3f ms  %s' % (name, elapsed, plan))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        engine = create_engine(
+            'sqlite:///' + os.path.join(folder, 'bench.db'))
+        Base.metadata.create_all(engine)
+        # start from the schema as it was before the index migration
+        for index in NEW_INDEXES:
+            engine.execute('DROP INDEX %s' % index)
+        populate(engine, args.users, args.categories, args.items)
+
+        report('Before (%d items):' % args.items,
+               measure(engine, args.repeat))
+        migrations.upgrade(engine)
+        engine.execute('ANALYZE')
+        report('After:', measure(engine, args.repeat))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
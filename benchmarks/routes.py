@@ -0,0 +1,307 @@
+"""
+    End-to-end benchmark of the catalog routes on a generated catalog.
+
+    python -m benchmarks.routes [--items 20000] [--baseline FILE]
+    python -m benchmarks.routes --save-baseline benchmarks/baseline.json
+    python -m benchmarks.routes --replicas 2 [--replica-selection ...]
+
+    Every route is first requested one request at a time through the test
+    client, recording latency percentiles and SQL statements per request,
+    then a mixed load is driven from several threads. With --baseline the
+    run fails when a route issues more statements than the baseline, or
+    when a p95 latency or the load throughput is worse than the baseline
+    by more than the tolerance. With --replicas the reads go to copies of
+    the generated database, made as local SQLite read replicas.
+"""
+
+from benchmarks import generate
+from sqlalchemy import event
+from werkzeug.urls import url_quote
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+
+# Route name and URL, %(category)s and %(item)s are filled in with
+# names sampled from the generated catalog, %(largest)s with the category
+# the generator gives the most items
+ROUTES = [
+    ('home', '/'),
+    ('category (largest)', '/category/%(largest)s/'),
+    ('category', '/category/%(category)s/'),
+    ('item', '/item/%(item)s'),
+    ('catalog json', '/catalog/json?limit=10'),
+    ('recent atom', '/catalog/recent.atom'),
+    ('search', '/search?q=barbell+curl'),
+    ('search json', '/search/json?q=dead'),
+]
+
+# Share of each route in the concurrent load
+MIX = {
+    'home': 30,
+    'item': 30,
+    'category': 15,
+    'category (largest)': 5,
+    'search': 10,
+    'search json': 4,
+    'catalog json': 3,
+    'recent atom': 3,
+}
+
+# Settings written for the benchmarked application
+SETTINGS = """
+DATABASE_URI = 'sqlite:///%(folder)s/bench.db'
+SESSION_DATABASE_URI = 'sqlite:///%(folder)s/sessions.db'
+CACHE_TYPE = %(cache)r
+DATABASE_REPLICA_URIS = [%(replicas)s]
+DATABASE_REPLICA_SELECTION = %(selection)r
+"""
+
+REPLICA_URI = "'sqlite:///%(folder)s/replica%(number)d.db'"
+
+
+def percentile(timings, p):
+    """ Return the p-th percentile of sorted timings, nearest rank """
+    return timings[min(len(timings) - 1, int(len(timings) * p / 100.0))]
+
+
+def summary(timings):
+    timings = sorted(timings)
+    return {'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3)}
+
+
+def peak_memory():
+    """ Return the peak resident set size of the process in megabytes """
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+                 1)
+
+
+def build(engine, args, folder):
+    """ Create the schema and import a generated catalog """
+    from catalog import bulk, migrations, search
+    from catalog.models import Base
+
+    Base.metadata.create_all(engine)
+    with engine.connect() as connection:
+        search.create_index(connection)
+        migrations.stamp(connection, migrations.latest_version())
+
+    path = os.path.join(folder, 'items.jsonl')
+    generate.write(path, generate.generate(
+        args.items, args.categories, args.users, seed=args.seed))
+    with open(path) as f:
+        bulk.import_items(engine, f, 'jsonl', None, 5000,
+                          defer_search_index=True)
+    engine.execute('ANALYZE')
+
+
+def route_urls(engine, rng, samples):
+    """ Return the URLs requested for every route """
+    categories = [row[0] for row in engine.execute(
+        'SELECT name FROM category ORDER BY id')]
+    items = [row[0] for row in engine.execute('SELECT name FROM item')]
+    urls = {}
+    for name, url in ROUTES:
+        urls[name] = [url % {'category': url_quote(rng.choice(categories)),
+                             'item': url_quote(rng.choice(items)),
+                             'largest': url_quote('Category 0')}
+                      for i in range(samples)]
+    return urls
+
+
+def sequential(app, engines, urls, requests):
+    """ Request each route in turn, return its timings and statements """
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    # SQLAlchemy 0.8 cannot remove engine listeners, the counter stays
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count)
+    client = app.test_client()
+    results = {}
+    for name, url in ROUTES:
+        # the first request compiles templates and fills the pool
+        client.get(urls[name][0]).close()
+        timings = []
+        statements[0] = 0
+        for i in range(requests):
+            url = urls[name][i % len(urls[name])]
+            started = time.time()
+            response = client.get(url)
+            response.get_data()
+            timings.append((time.time() - started) * 1000)
+            if response.status_code != 200:
+                sys.exit('%s returned %s' % (url, response.status))
+        results[name] = summary(timings)
+        results[name]['queries'] = statements[0] / float(requests)
+    return results
+
+
+def load(app, urls, threads, duration, seed):
+    """ Drive a mixed load from several threads for duration seconds """
+    names = sorted(MIX)
+    weights = [MIX[name] for name in names]
+    timings = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def worker(number):
+        rng = random.Random(seed + number)
+        client = app.test_client()
+        mine = []
+        failed = 0
+        while time.time() < deadline:
+            pick = rng.random() * sum(weights)
+            for name, weight in zip(names, weights):
+                pick -= weight
+                if pick < 0:
+                    break
+            started = time.time()
+            response = client.get(rng.choice(urls[name]))
+            response.get_data()
+            mine.append((time.time() - started) * 1000)
+            failed += response.status_code != 200
+        with lock:
+            timings.extend(mine)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=worker, args=(n,))
+               for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    result = summary(timings)
+    result['throughput'] = round(len(timings) / float(duration), 1)
+    result['errors'] = errors[0]
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """ Return the regressions of results against the baseline """
+    regressions = []
+    for name, route in sorted(results['routes'].items()):
+        before = baseline['routes'].get(name)
+        if before is None:
+            continue
+        if route['queries'] > before['queries']:
+            regressions.append('%s: %.1f statements per request, was %.1f' % (
+                name, route['queries'], before['queries']))
+        if route['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append('%s: p95 %.1f ms, was %.1f ms' % (
+                name, route['p95_ms'], before['p95_ms']))
+    if results['load']['throughput'] < \
+            baseline['load']['throughput'] * (1 - tolerance):
+        regressions.append('load: %.1f requests/s, was %.1f' % (
+            results['load']['throughput'], baseline['load']['throughput']))
+    if results['load']['errors']:
+        regressions.append('load: %d failed requests' %
+                           results['load']['errors'])
+    return regressions
+
+
+def report(results):
+    print('%(items)d items, %(categories)d categories, %(users)d users, '
+          'cache %(cache)s, %(replicas)d replicas' % results['params'])
+    print('%-20s %9s %9s %9s %8s' % ('route', 'p50 ms', 'p95 ms', 'p99 ms',
+                                     'queries'))
+    for name, url in ROUTES:
+        print('%-20s ' % name + '%(p50_ms)9.2f %(p95_ms)9.2f %(p99_ms)9.2f '
+              '%(queries)8.1f' % results['routes'][name])
+    print('load, %(threads)d threads: %(throughput).1f requests/s, '
+          'p50 %(p50_ms).2f ms, p95 %(p95_ms).2f ms, p99 %(p99_ms).2f ms, '
+          '%(errors)d errors' % dict(results['load'],
+                                     threads=results['params']['threads']))
+    print('peak memory: %.1f MB' % results['peak_memory_mb'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--requests', type=int, default=50,
+                        help='requests per route')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds of concurrent load')
+    parser.add_argument('--cache', default='null',
+                        help='CACHE_TYPE of the application, the default '
+                             'measures the views rather than the cache')
+    parser.add_argument('--replicas', type=int, default=0,
+                        help='SQLite read replicas to copy the database to')
+    parser.add_argument('--replica-selection', default='round-robin',
+                        choices=['round-robin', 'least-latency'])
+    parser.add_argument('--baseline', help='fail on regressions against '
+                                           'this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='allowed slowdown against the baseline')
+    parser.add_argument('--save-baseline', metavar='FILE',
+                        help='write the results as the new baseline')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        settings = os.path.join(folder, 'settings.py')
+        with open(settings, 'w') as f:
+            f.write(SETTINGS % {
+                'folder': folder, 'cache': args.cache,
+                'replicas': ', '.join(REPLICA_URI % {'folder': folder,
+                                                     'number': number}
+                                      for number in range(args.replicas)),
+                'selection': args.replica_selection})
+        # the application reads its settings when first imported
+        os.environ['CATALOG_SETTINGS'] = settings
+        from catalog import app, engine, router
+        from catalog.routing import sync_replicas
+
+        build(engine, args, folder)
+        sync_replicas(app.config)
+        urls = route_urls(engine, random.Random(args.seed), args.requests)
+        results = {
+            'params': {'items': args.items, 'categories': args.categories,
+                       'users': args.users, 'seed': args.seed,
+                       'threads': args.threads, 'cache': args.cache,
+                       'replicas': args.replicas},
+            'routes': sequential(app, router.engines, urls, args.requests),
+            'load': load(app, urls, args.threads, args.duration, args.seed),
+            'peak_memory_mb': peak_memory(),
+        }
+        for engine in router.engines:
+            engine.dispose()
+    finally:
+        shutil.rmtree(folder)
+
+    report(results)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['params'] != results['params']:
+            sys.exit('baseline was recorded with %s' % baseline['params'])
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
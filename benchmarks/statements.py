@@ -0,0 +1,122 @@
+"""
+    Check the number of SQL statements every route issues.
+
+    python -m benchmarks.statements
+
+    Each route is requested through the test client on a copy of the
+    sample database, catalog.db, with the catalog cache turned off so the
+    views run all their queries. The run fails when a route issues more
+    or fewer statements than expected. Every count is a constant: a route
+    whose count grows with the catalog has an N+1 query.
+"""
+
+from sqlalchemy import event
+import os
+import shutil
+import sys
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Route name, URL, whether the visitor is logged in, and the exact number
+# of statements. %(category)s and %(item)s are a sample category and item.
+# Cached views read the catalog version once for anonymous visitors.
+ROUTES = [
+    ('home', '/', False, 3),
+    ('home, logged in', '/', True, 2),
+    ('category', '/category/%(category)s/', False, 4),
+    ('category json', '/category/%(category)s/json', False, 3),
+    ('category atom', '/category/%(category)s/recent.atom', False, 3),
+    ('item', '/item/%(item)s', False, 2),
+    ('item json', '/item/%(item)s/json', False, 2),
+    ('catalog json', '/catalog/json', False, 1),
+    ('recent atom', '/catalog/recent.atom', False, 2),
+    ('search', '/search?q=curl', False, 3),
+    ('search json', '/search/json?q=curl', False, 2),
+    ('new item form', '/item/new/', True, 1),
+    ('edit item form', '/item/%(item)s/edit/', True, 2),
+    ('api catalog json', '/api/catalog/json', False, 1),
+    ('api category json', '/api/category/%(category)s/json', False, 2),
+    ('api item json', '/api/item/%(item)s/json', False, 1),
+    ('api recent atom', '/api/catalog/recent.atom', False, 1),
+]
+
+# Settings written for the checked application
+SETTINGS = """
+DATABASE_URI = 'sqlite:///%(folder)s/catalog.db'
+SESSION_DATABASE_URI = 'sqlite:///%(folder)s/sessions.db'
+TEMPLATE_CACHE_FOLDER = None
+UPLOAD_FOLDER = '%(folder)s/uploads'
+CACHE_TYPE = 'null'
+UPLOAD_SWEEP_INTERVAL = 0
+"""
+
+
+def count_statements(app, engines, routes, values, user_id):
+    """ Request every route, return the statements each issued """
+    statements = [0]
+
+    def count(*args):
+        statements[0] += 1
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count)
+    counts = []
+    for name, url, logged_in, expected in routes:
+        client = app.test_client()
+        if logged_in:
+            with client.session_transaction() as session:
+                session['user_id'] = user_id
+                session['username'] = 'sample'
+                session['email'] = 'sample@example.com'
+        # the first request loads templates and opens connections
+        client.get(url % values).close()
+        statements[0] = 0
+        response = client.get(url % values)
+        response.get_data()
+        if response.status_code != 200:
+            sys.exit('%s returned %s' % (url % values, response.status))
+        counts.append(statements[0])
+    return counts
+
+
+def main():
+    folder = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(ROOT, 'catalog.db'), folder)
+        settings = os.path.join(folder, 'settings.py')
+        with open(settings, 'w') as f:
+            f.write(SETTINGS % {'folder': folder})
+        # the application reads its settings when first imported
+        os.environ['CATALOG_SETTINGS'] = settings
+        from catalog import app, engine, router, migrations
+        from werkzeug.urls import url_quote
+
+        migrations.upgrade(engine)
+        category, user_id = engine.execute(
+            'SELECT name, user_id FROM category ORDER BY id').first()
+        item = engine.execute(
+            'SELECT name FROM item WHERE user_id = ? ORDER BY id',
+            user_id).scalar()
+        values = {'category': url_quote(category), 'item': url_quote(item)}
+        counts = count_statements(app, router.engines, ROUTES, values,
+                                  user_id)
+        for engine in router.engines:
+            engine.dispose()
+    finally:
+        shutil.rmtree(folder)
+
+    failures = 0
+    print('%-20s %8s %8s' % ('route', 'expected', 'issued'))
+    for (name, url, logged_in, expected), count in zip(ROUTES, counts):
+        print('%-20s %8d %8d%s' % (name, expected, count,
+                                   '' if count == expected else '  FAIL'))
+        failures += count != expected
+    if failures:
+        sys.exit('%d routes issued an unexpected number of statements'
+                 % failures)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+    Measure template compile and render times of the read-only pages.
+
+    python -m benchmarks.templates [--renders 200]
+
+    For every template this reports the first render in a fresh template
+    environment, compiling the template and the ones it extends and
+    includes, the first render with the compiled templates loaded from a
+    warm bytecode cache, and the median render time once loaded.
+"""
+
+from catalog import app
+from catalog.pagination import Page
+from catalog.templating import TemplateBytecodeCache, compile_templates
+import argparse
+import shutil
+import tempfile
+import time
+
+
+def contexts(categories):
+    """ Return a sample context for each template, built from plain
+    values as the views pass them """
+    category_list = [{'id': i, 'name': 'Category %d' % i,
+                      'url': '/category/Category%%20%d/' % i}
+                     for i in range(categories)]
+    page = Page([], '20160102221123000000.2772', '20160103014903000000.2990')
+    return {
+        'catalog.html': dict(
+            categories=category_list,
+            latest_items=[{'name': 'item %d' % i,
+                           'category_name': 'Category %d' % i}
+                          for i in range(10)],
+            page=page),
+        'category.html': dict(
+            categories=category_list,
+            category={'name': 'Category 0', 'user_id': 1},
+            items=[{'name': 'item %d' % i} for i in range(50)],
+            item_count=4000,
+            page=page),
+        'item.html': dict(
+            item={'name': 'item 1', 'description': 'Description ' * 20,
+                  'user_id': 1, 'image': 'squat.png',
+                  'image_card': 'squat.card.webp',
+                  'image_full': 'squat.full.webp'},
+            owner={'name': 'User 1', 'picture': '/picture.png'}),
+        'search.html': dict(
+            categories=category_list, query='curl', page=1, more=True,
+            results=[{'name': 'item %d' % i, 'snippet': 'barbell curl'}
+                     for i in range(20)]),
+    }
+
+
+def environment(bytecode_folder=None):
+    """ Return a new template environment for the app """
+    env = app.create_jinja_environment()
+    env.globals.update(app.jinja_env.globals)
+    if bytecode_folder is not None:
+        env.bytecode_cache = TemplateBytecodeCache(bytecode_folder)
+    return env
+
+
+def render(env, name, context):
+    """ Render a template the way flask.render_template does """
+    context = dict(context)
+    app.update_template_context(context)
+    return env.get_template(name).render(context)
+
+
+def first_render(name, context, bytecode_folder=None):
+    """ Return the milliseconds of the first render in a new environment """
+    env = environment(bytecode_folder)
+    started = time.time()
+    render(env, name, context)
+    return (time.time() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--categories', type=int, default=200,
+                        help='categories in the sidebar')
+    parser.add_argument('--renders', type=int, default=200)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        compile_templates(environment(folder))
+        print('%-16s %14s %14s %14s' % ('template', 'compile ms',
+                                        'bytecode ms', 'render ms'))
+        with app.test_request_context('/'):
+            for name, context in sorted(contexts(args.categories).items()):
+                compiled = first_render(name, context)
+                cached = first_render(name, context, folder)
+                env = environment()
+                render(env, name, context)
+                timings = []
+                for i in range(args.renders):
+                    started = time.time()
+                    render(env, name, context)
+                    timings.append((time.time() - started) * 1000)
+                timings.sort()
+                print('%-16s %14.2f %14.2f %14.3f' % (
+                    name, compiled, cached, timings[len(timings) // 2]))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    main()
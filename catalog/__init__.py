@@ -1,29 +1,115 @@
 """
     Catalog App Initialization.
-    Initialize the Flask framework.
-    Initialize the SQLAlchemy ORM.
+    Initialize the Flask framework and the template bytecode cache.
+    Initialize the server-side session store.
+    Initialize the SQLAlchemy ORM and the read replica routing.
+    Initialize the catalog cache.
+    Initialize the upload storage, image pipeline and upload sweeper.
+    Initialize the OAuth provider client.
+    Initialize the optional request instrumentation.
+    Mount the read-only API next to the app.
 """
 
  
 from flask import Flask
 from flask_wtf.csrf import CsrfProtect
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from flask import _app_ctx_stack
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from catalog.cache import make_cache
+from catalog.database import make_engine
+from catalog.images import ImagePipeline
+from catalog.instrumentation import Instrumentation
+from catalog.oauth import make_oauth_client
+from catalog.readapi import ReadAPI
+from catalog.routing import RoutingSession, make_router
+from catalog.serving import compress_response
+from catalog.sessions import make_session_interface
+from catalog.storage import UploadStorage, IMAGE_EXTENSIONS, makedirs
+from catalog.sweeper import UploadSweeper
+from catalog.templating import TemplateBytecodeCache
+from catalog.users import UserIdentity
+from werkzeug.wsgi import DispatcherMiddleware
 
 
 # Initialize Flask framework
 app = Flask(__name__)
 app.config.from_object('config')
+# optional settings file overriding config.py
+app.config.from_envvar('CATALOG_SETTINGS', silent=True)
 
 csrf = CsrfProtect(app)
 
-# Connect to database
-engine = create_engine(app.config['DATABASE_URI'])
+# Sessions are kept on the server, the cookie only carries their id
+app.session_interface = make_session_interface(app.config)
+
+# Compiled templates are cached on disk, shared by workers and restarts
+if app.config['TEMPLATE_CACHE_FOLDER']:
+    makedirs(app.config['TEMPLATE_CACHE_FOLDER'])
+    app.jinja_env.bytecode_cache = TemplateBytecodeCache(
+        app.config['TEMPLATE_CACHE_FOLDER'])
+
+# Connect to database, the primary and any read replicas
+engine = make_engine(app.config)
+router = make_router(app.config, engine)
+
+# Get a database session object, scoped to the current application context.
+# It reads from a replica while serving GET requests.
+DBSession = sessionmaker(bind=engine, class_=RoutingSession, router=router)
+db_session = scoped_session(DBSession,
+                            scopefunc=_app_ctx_stack.__ident_func__)
+
+
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    """ Return the request's connection to the pool """
+    db_session.remove()
+
+
+# Compress dynamic responses for clients that accept it
+app.after_request(compress_response)
+
+# Cache for the category sidebar, latest items and anonymous pages, filled
+# from the primary database
+cache = make_cache(app, loading=router.primary_reads)
+
+# Content addressed storage for uploaded files
+storage = UploadStorage(app.config['UPLOAD_FOLDER'],
+                        app.config['UPLOAD_CHUNK_SIZE'])
+
+# Background generation of resized upload images
+images = ImagePipeline(engine, app.config['UPLOAD_FOLDER'],
+                       app.config['IMAGE_VARIANTS'],
+                       app.config['IMAGE_FORMAT'],
+                       app.config['IMAGE_QUALITY'],
+                       app.config['IMAGE_WORKERS'],
+                       on_processed=cache.touch)
+
+# Background removal of uploads no item refers to any more
+sweeper = UploadSweeper(engine, app.config['UPLOAD_FOLDER'],
+                        app.config['UPLOAD_QUARANTINE_FOLDER'],
+                        app.config['UPLOAD_SWEEP_MIN_AGE'],
+                        app.config['UPLOAD_SWEEP_GRACE'],
+                        app.config['UPLOAD_SWEEP_INTERVAL'],
+                        app.config['UPLOAD_SWEEP_BATCH_SIZE'],
+                        IMAGE_EXTENSIONS + (images.extension,),
+                        app.config['UPLOAD_SWEEP_DRY_RUN'])
+app.before_first_request(sweeper.start)
+
+# Login provider client, with the provider secrets loaded once
+oauth = make_oauth_client(app.config)
+
+# Cached user lookups for logins
+users = UserIdentity(app.config['USER_CACHE_SIZE'])
+
+# Request timings, slow query log, metrics and profiler, if enabled
+instrumentation = Instrumentation(app, router.engines, oauth)
 
-# Get a database session object
-DBSession = sessionmaker(bind=engine)
-db_session = DBSession()
+# Read-only API, also served on its own by serve_reads.py
+read_api = ReadAPI(app.config, router)
+app.wsgi_app = DispatcherMiddleware(app.wsgi_app,
+                                    {app.config['READ_API_PREFIX']: read_api})
 
 # Flask view functions
 import catalog.views
@@ -0,0 +1,91 @@
+"""
+    Helpers for the JSON API: item field selection and response encoding.
+
+    Clients choose the item fields they need with ?fields=name,pub_date,
+    and only those columns are read from the database. Responses are JSON,
+    or MessagePack for clients that send Accept: application/x-msgpack
+    when the msgpack package is installed.
+"""
+
+from catalog.models import Item
+from catalog.pagination import decode_cursor
+from flask import request, abort, jsonify, Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Item fields of the API, in output order
+ITEM_FIELDS = ('id', 'name', 'description', 'image', 'pub_date',
+               'category_id', 'user_id')
+
+PUB_DATE_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+
+MSGPACK = 'application/x-msgpack'
+
+
+def item_fields():
+    """ Return the item fields named by the fields request argument, all
+    of them by default. Unknown field names are a 400 Bad Request. """
+    fields = request.args.get('fields')
+    if not fields:
+        return ITEM_FIELDS
+    fields = tuple(field.strip() for field in fields.split(','))
+    if not all(field in ITEM_FIELDS for field in fields):
+        abort(400)
+    return fields
+
+
+def item_selection(fields, *required):
+    """ Return the item fields to select: fields, followed by the
+    required fields not among them """
+    return fields + tuple(field for field in required if field not in fields)
+
+
+def item_columns(selection):
+    """ Return the Item columns of a selection of fields """
+    return [getattr(Item, field) for field in selection]
+
+
+def item_dict(row, fields, offset=0):
+    """ Return the requested fields of a row whose columns, from offset
+    on, were selected for them """
+    result = {}
+    for i, field in enumerate(fields):
+        value = row[offset + i]
+        if field == 'pub_date' and value is not None:
+            value = value.strftime(PUB_DATE_FORMAT)
+        result[field] = value
+    return result
+
+
+def cursor_args():
+    """ Return the after and before page cursors of the request, a
+    malformed cursor is a 400 Bad Request """
+    after = request.args.get('after')
+    before = request.args.get('before')
+    for cursor in (after, before):
+        if cursor is not None:
+            try:
+                decode_cursor(cursor)
+            except ValueError:
+                abort(400)
+    return after, before
+
+
+def response_format():
+    """ Return the negotiated response format, 'msgpack' or 'json' """
+    if msgpack is not None and request.accept_mimetypes.best_match(
+            ['application/json', MSGPACK]) == MSGPACK:
+        return 'msgpack'
+    return 'json'
+
+
+def api_response(**data):
+    """ Return data in the negotiated format """
+    if response_format() == 'msgpack':
+        return Response(msgpack.packb(data, use_bin_type=True),
+                        mimetype=MSGPACK)
+    return jsonify(**data)
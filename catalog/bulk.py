@@ -0,0 +1,218 @@
+"""
+    Bulk import and export of catalog items.
+
+    Items are read from and written to CSV or JSON Lines files as a
+    stream, one record per item with the columns in FIELDS. Imports insert
+    in batches, each in its own transaction, resolving category names and
+    user emails for a whole batch at once.
+"""
+
+from catalog import search
+from catalog.models import User, Category, Item, reconcile_item_counts
+from datetime import datetime
+from sqlalchemy import select
+from operator import itemgetter
+import csv
+import json
+import re
+import time
+
+
+FIELDS = ('name', 'description', 'category', 'image', 'user_email',
+          'pub_date')
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+ISO_DATE = re.compile(r'^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d$')
+
+# item columns written by an import
+ITEM_COLUMNS = ('name', 'description', 'image', 'category_id', 'user_id',
+                'pub_date')
+
+# keys looked up per query when resolving users and categories
+LOOKUP_SIZE = 500
+
+
+def read_records(f, format):
+    """ Yield item records, as dicts of unicode strings, from a file """
+    if format == 'csv':
+        for row in csv.DictReader(f):
+            yield dict((key, value.decode('utf-8') if value else None)
+                       for key, value in row.items())
+    else:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_records(f, format, records):
+    """ Write item records to a file, returning how many were written """
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(dict(
+                (key, value.encode('utf-8') if value else value)
+                for key, value in record.items()))
+            count += 1
+    else:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+            count += 1
+    return count
+
+
+def storage_date(value):
+    """ Convert an ISO 8601 date to SQLite's DATETIME storage format """
+    if not ISO_DATE.match(value):
+        raise ValueError('pub_date %r is not YYYY-MM-DDTHH:MM:SS' % value)
+    return value.replace('T', ' ') + '.000000'
+
+
+def batches(records, size):
+    """ Split an iterable into lists of at most size records """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Importer(object):
+    """ Loads item records in batched transactions """
+
+    def __init__(self, connection, default_email, skip_existing=False):
+        self.connection = connection
+        self.default_email = default_email
+        self.skip_existing = skip_existing
+        # ids resolved so far, by user email and category name
+        self.user_ids = {}
+        self.category_ids = {}
+        insert = Item.__table__.insert()
+        if skip_existing:
+            insert = insert.prefix_with('OR IGNORE')
+        insert = insert.compile(dialect=connection.dialect,
+                                column_keys=ITEM_COLUMNS)
+        self.insert = str(insert)
+        # picks the statement's positional parameters out of a row dict
+        self.parameters = itemgetter(*insert.positiontup)
+
+    def resolve(self, table, column, keys, cache, new_row):
+        """ Look up ids of keys in bulk, inserting rows for missing keys """
+        missing = set(keys) - set(cache)
+        if missing:
+            self.lookup(table, column, missing, cache)
+            missing -= set(cache)
+        if missing:
+            self.connection.execute(table.insert(),
+                                    [new_row(key) for key in missing])
+            self.lookup(table, column, missing, cache)
+
+    def lookup(self, table, column, keys, cache):
+        """ Add the ids of rows whose column is in keys to cache """
+        keys = list(keys)
+        # stay below the database's limit on bound parameters
+        for start in range(0, len(keys), LOOKUP_SIZE):
+            query = select([table.c.id, column]) \
+                .where(column.in_(keys[start:start + LOOKUP_SIZE]))
+            cache.update(
+                (key, id) for id, key in self.connection.execute(query))
+
+    def load(self, batch):
+        """ Insert one batch of records in a transaction, returning the
+        number of items inserted """
+        for record in batch:
+            record['user_email'] = record.get('user_email') or \
+                self.default_email
+
+        with self.connection.begin():
+            self.resolve(
+                User.__table__, User.__table__.c.email,
+                [r['user_email'] for r in batch], self.user_ids,
+                lambda email: {'email': email, 'name': email.split('@')[0]})
+            # new categories belong to the user of their first item
+            owners = dict((r['category'], self.user_ids[r['user_email']])
+                          for r in reversed(batch))
+            self.resolve(
+                Category.__table__, Category.__table__.c.name,
+                owners, self.category_ids,
+                lambda name: {'name': name, 'user_id': owners[name]})
+
+            now = storage_date(datetime.utcnow().strftime(DATE_FORMAT))
+            # executemany on the DB-API cursor skips per row processing
+            cursor = self.connection.connection.cursor()
+            rows = ({
+                'name': r['name'],
+                'description': r.get('description'),
+                'image': r.get('image'),
+                'category_id': self.category_ids[r['category']],
+                'user_id': self.user_ids[r['user_email']],
+                'pub_date': (storage_date(r['pub_date'])
+                             if r.get('pub_date') else now),
+            } for r in batch)
+            cursor.executemany(self.insert, map(self.parameters, rows))
+            inserted = cursor.rowcount
+            cursor.close()
+        return inserted
+
+
+def import_items(engine, f, format, default_email, batch_size,
+                 skip_existing=False, defer_search_index=False,
+                 progress=None):
+    """ Import item records from a file.
+
+    Returns the number of records read and of items inserted, which is
+    lower when skip_existing skipped items.
+
+    With defer_search_index the search index is rebuilt once after the
+    import rather than updated for every row, which is faster for imports
+    that are large compared to the catalog. progress is called after each
+    batch with the records loaded so far and the elapsed seconds. Category
+    item counts are recomputed at the end.
+    """
+    started = time.time()
+    count = inserted = 0
+    with engine.connect() as connection:
+        importer = Importer(connection, default_email, skip_existing)
+        if defer_search_index:
+            search.suspend_index(connection)
+        try:
+            for batch in batches(read_records(f, format), batch_size):
+                inserted += importer.load(batch)
+                count += len(batch)
+                if progress is not None:
+                    progress(count, time.time() - started)
+        finally:
+            # a failed import must not leave search without its index
+            if defer_search_index:
+                search.create_index(connection)
+            reconcile_item_counts(connection)
+    return count, inserted
+
+
+def export_items(engine, f, format):
+    """ Write every item to a file, returning the number written """
+    item, category, user = (Item.__table__, Category.__table__,
+                            User.__table__)
+    query = select([item.c.name, item.c.description,
+                    category.c.name.label('category'), item.c.image,
+                    user.c.email.label('user_email'), item.c.pub_date]) \
+        .select_from(item.join(category, item.c.category_id == category.c.id)
+                     .outerjoin(user, item.c.user_id == user.c.id)) \
+        .order_by(item.c.id)
+
+    def records():
+        with engine.connect() as connection:
+            rows = connection.execution_options(stream_results=True) \
+                .execute(query)
+            for row in rows:
+                record = dict(row)
+                if record['pub_date'] is not None:
+                    record['pub_date'] = \
+                        record['pub_date'].strftime(DATE_FORMAT)
+                yield record
+
+    return write_records(f, format, records())
@@ -0,0 +1,167 @@
+"""
+    In-process cache for rarely changing catalog data and for pages
+    rendered for anonymous visitors.
+
+    Values are stored through a werkzeug cache backend, so the default
+    in-memory SimpleCache can be swapped for Redis, memcached or any class
+    implementing werkzeug.contrib.cache.BaseCache.
+"""
+
+from datetime import datetime
+from functools import wraps
+from catalog.serving import COMPRESSIBLE, accepted_encoding, compress
+from flask import request, session, Response
+from werkzeug.contrib.cache import SimpleCache, RedisCache, NullCache
+from werkzeug.utils import import_string
+import hashlib
+import uuid
+
+
+# Cache keys
+CATEGORIES = 'categories'
+LATEST_ITEMS = 'latest_items'
+VERSION = 'version'
+PAGE = 'page'
+
+BACKENDS = {
+    'simple': SimpleCache,
+    'redis': RedisCache,
+    'null': NullCache,
+}
+
+
+class CatalogCache(object):
+    """ Cache front end that counts hits and misses per key """
+
+    def __init__(self, app, backend, timeout, version_timeout, loading=None):
+        self.app = app
+        self.backend = backend
+        # context manager loaders are called in, when values are stored
+        self.loading = None if isinstance(backend, NullCache) else loading
+        self.timeout = timeout
+        # the version must not outlive the entries it stands for, or a
+        # worker that missed a write keeps its Last-Modified date
+        self.version_timeout = min(version_timeout, timeout)
+        self.hits = {}
+        self.misses = {}
+
+    def get_or_load(self, key, loader, timeout=None, stat=None):
+        """ Return the cached value for key, calling loader on a miss.
+
+        Hits and misses are counted under stat, which defaults to key.
+        """
+        stat = stat or key
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits[stat] = self.hits.get(stat, 0) + 1
+            return value
+        self.misses[stat] = self.misses.get(stat, 0) + 1
+        if self.loading is None:
+            value = loader()
+        else:
+            with self.loading():
+                value = loader()
+        self.backend.set(key, value,
+                         timeout=self.timeout if timeout is None else timeout)
+        return value
+
+    def delete(self, *keys):
+        """ Remove keys from the cache """
+        for key in keys:
+            self.backend.delete(key)
+
+    def version(self, loader):
+        """ Return the catalog version as (last modified, generation).
+
+        loader returns the last modified datetime when the version is not
+        cached. Cached pages are keyed by generation, so a new version
+        makes every page cached before it unreachable.
+        """
+        return self.get_or_load(
+            VERSION, lambda: (loader(), uuid.uuid4().hex),
+            timeout=self.version_timeout)
+
+    def touch(self):
+        """ Start a new catalog version after a write is committed """
+        self.backend.set(VERSION,
+                         (datetime.utcnow().replace(microsecond=0),
+                          uuid.uuid4().hex),
+                         timeout=self.version_timeout)
+
+    def cached_response(self, version_loader, vary=None):
+        """ Decorator caching a view's response for anonymous visitors.
+
+        Responses carry a strong ETag and a Last-Modified date taken from
+        the catalog version, and are answered with 304 Not Modified when
+        the client's copy is current. A Last-Modified date set by the view
+        itself is kept. Compressed copies are cached next to the response
+        for clients that accept them.
+
+        vary is an optional (header, function) pair for views whose
+        response depends on a request header; the function's result is
+        part of the cache key.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if (request.method != 'GET' or 'user_id' in session or
+                        '_flashes' in session):
+                    return view(*args, **kwargs)
+
+                last_modified, generation = self.version(version_loader)
+                key = '%s:%s:%s%s' % (PAGE, generation,
+                                      request.host, request.full_path)
+                if vary is not None:
+                    key += ':' + vary[1]()
+                entry = self.get_or_load(
+                    key, lambda: self._render(view, args, kwargs), stat=PAGE)
+                data, mimetype, etag, view_modified = entry
+                encoding = accepted_encoding(mimetype, len(data))
+                if encoding is not None:
+                    data = self.get_or_load(
+                        '%s:%s' % (key, encoding),
+                        lambda: compress(data, encoding), stat=PAGE)
+                    # every representation has an ETag of its own
+                    etag = '%s-%s' % (etag, encoding)
+                response = Response(data, mimetype=mimetype)
+                response.set_etag(etag)
+                response.last_modified = view_modified or last_modified
+                response.vary.add('Cookie')
+                if vary is not None:
+                    response.vary.add(vary[0])
+                if mimetype in COMPRESSIBLE:
+                    response.vary.add('Accept-Encoding')
+                if encoding is not None:
+                    response.content_encoding = encoding
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+    def _render(self, view, args, kwargs):
+        """ Run a view and return its response as a cacheable entry """
+        response = self.app.make_response(view(*args, **kwargs))
+        data = response.get_data()
+        return (data, response.mimetype, hashlib.sha1(data).hexdigest(),
+                response.last_modified)
+
+    def stats(self):
+        """ Return hit and miss counters for every key or stat seen """
+        keys = set(self.hits) | set(self.misses)
+        return dict((key, {'hits': self.hits.get(key, 0),
+                           'misses': self.misses.get(key, 0)})
+                    for key in keys)
+
+
+def make_cache(app, loading=None):
+    """ Create the catalog cache from the app's CACHE_* settings. Values
+    are loaded within the loading context manager, if there is one. """
+    config = app.config
+    backend_class = config['CACHE_TYPE']
+    if backend_class in BACKENDS:
+        backend_class = BACKENDS[backend_class]
+    else:
+        # dotted path to a custom BaseCache implementation
+        backend_class = import_string(backend_class)
+    backend = backend_class(**config['CACHE_OPTIONS'])
+    return CatalogCache(app, backend, config['CACHE_DEFAULT_TIMEOUT'],
+                        config['CACHE_VERSION_TIMEOUT'], loading)
@@ -0,0 +1,65 @@
+"""
+    Database engine and connection pool setup.
+"""
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+def make_engine(config, uri=None, replica=False):
+    """ Create a database engine with a connection pool sized by config,
+    for the database at uri, DATABASE_URI by default.
+
+    Connections to a replica are read only and recycled more often, so a
+    refreshed copy of the database is picked up.
+    """
+    url = make_url(uri or config['DATABASE_URI'])
+    options = {
+        'poolclass': QueuePool,
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_recycle': config['DATABASE_REPLICA_RECYCLE' if replica
+                               else 'DATABASE_POOL_RECYCLE'],
+    }
+    sqlite = url.drivername.startswith('sqlite')
+    if sqlite:
+        # pooled connections are handed out to whichever thread asks
+        options['connect_args'] = {'check_same_thread': False}
+
+    engine = create_engine(url, **options)
+
+    if sqlite:
+        event.listen(engine, 'connect', sqlite_pragmas(
+            None if replica else config['SQLITE_JOURNAL_MODE'],
+            config['SQLITE_BUSY_TIMEOUT'], query_only=replica))
+    if config['DATABASE_POOL_PRE_PING']:
+        event.listen(engine, 'checkout', ping_connection)
+    return engine
+
+
+def sqlite_pragmas(journal_mode, busy_timeout, query_only=False):
+    """ Return a connect listener applying SQLite pragmas """
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if journal_mode is not None:
+            # WAL lets readers proceed while a writer holds the database
+            cursor.execute('PRAGMA journal_mode=%s' % journal_mode)
+        # wait for locks instead of failing with 'database is locked'
+        cursor.execute('PRAGMA busy_timeout=%d' % busy_timeout)
+        if query_only:
+            cursor.execute('PRAGMA query_only=1')
+        cursor.close()
+    return on_connect
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """ Check a pooled connection is alive before handing it out """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        # the pool discards the connection and retries with a new one
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
@@ -3,6 +3,7 @@
     Flask-WTF forms.
 """ 
 
+from catalog.storage import IMAGE_EXTENSIONS
 from flask_wtf import Form
 from flask_wtf.file import FileField, FileAllowed
 from wtforms import StringField, SelectField, TextAreaField
@@ -22,6 +23,6 @@ class ItemForm(Form):
     description = TextAreaField('Description', validators=[Length(max=1000)])
     image = FileField('Image',
                       validators=[
-                          FileAllowed(['jpeg', 'jpg', 'png', 'gif', 'bmp'],
+                          FileAllowed(IMAGE_EXTENSIONS,
                                       'File must be an image.')])
     category_id = SelectField('Category', choices=None, coerce=int)
@@ -0,0 +1,86 @@
+"""
+    Background image processing for item uploads.
+
+    Uploaded originals are handed to a worker pool, which writes resized,
+    re-encoded variants next to the original and records them on the item.
+    Until then pages serve the original image.
+"""
+
+from catalog.models import Item
+from multiprocessing.pool import ThreadPool
+from PIL import Image
+import logging
+import os
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+def variant_filename(filename, variant, extension):
+    """ Return the file name of an image variant, e.g. a.thumb.webp """
+    return '%s.%s.%s' % (os.path.splitext(filename)[0], variant, extension)
+
+
+class ImagePipeline(object):
+    """ Generates image variants of uploads in background threads """
+
+    def __init__(self, engine, folder, variants, format, quality, workers,
+                 on_processed=None):
+        self.engine = engine
+        self.folder = folder
+        self.variants = variants
+        self.format = format
+        self.quality = quality
+        self.workers = workers
+        self.on_processed = on_processed
+        self.extension = format.lower()
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """ Worker pool, started on first use in the serving process """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            return self._pool
+
+    def submit(self, item_id, filename):
+        """ Queue variant generation for an item's uploaded image """
+        return self.pool.apply_async(self.process, (item_id, filename))
+
+    def process(self, item_id, filename):
+        """ Write every variant of an image and record them on the item """
+        try:
+            variants = [self.resize(filename, name, size)
+                        for name, size in self.variants]
+        except Exception:
+            log.exception('Could not process image %s', filename)
+            return
+
+        # the item may have been given another image in the meantime
+        item = Item.__table__
+        self.engine.execute(
+            item.update()
+            .where(item.c.id == item_id).where(item.c.image == filename)
+            .values(image_variants=','.join(variants)))
+        if self.on_processed is not None:
+            self.on_processed()
+
+    def resize(self, filename, variant, size):
+        """ Write one variant, fitting the image within size x size.
+
+        Returns the variant's file name.
+        """
+        variant = variant_filename(filename, variant, self.extension)
+        path = os.path.join(self.folder, variant)
+        if os.path.exists(path):
+            # stored files are named by content, so the variant is current
+            return variant
+        image = Image.open(os.path.join(self.folder, filename))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.thumbnail((size, size), Image.ANTIALIAS)
+        image.save(path, self.format, quality=self.quality)
+        return variant
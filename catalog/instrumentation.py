@@ -0,0 +1,267 @@
+"""
+    Opt-in request instrumentation.
+
+    Every request is timed, with the time spent in SQL statements,
+    template rendering and outbound HTTP calls to the login providers
+    accounted separately. Slow statements are logged with the view that
+    ran them, the results are exported in Prometheus text format, and an
+    optional sampling profiler writes the stacks of slow requests in the
+    collapsed format read by flamegraph.pl and speedscope.
+"""
+
+from collections import defaultdict
+from flask import request
+from jinja2 import Template
+from sqlalchemy import event
+import os
+import sys
+import threading
+import time
+
+
+# Parts of a request's time accounted separately
+PARTS = ('db', 'template', 'http')
+
+# OAuth client methods called by the views that reach the network
+HTTP_METHODS = ('request', 'get_all_json', 'exchange_google_code')
+
+
+class RequestTimings(object):
+    """ Time spent by one request """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.time()
+        self.status = None
+        self.statements = 0
+        self.seconds = dict.fromkeys(PARTS, 0.0)
+        self.samples = defaultdict(int)
+
+
+class Histogram(object):
+    """ Prometheus style histogram: cumulative bucket counts and sum """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Instrumentation(object):
+    """ Collect request timings of the app when INSTRUMENTATION is set """
+
+    def __init__(self, app, engines, oauth):
+        self.app = app
+        self.enabled = app.config['INSTRUMENTATION']
+        self.slow_query = app.config['SLOW_QUERY_THRESHOLD']
+        self.buckets = app.config['METRICS_BUCKETS']
+        self.profile_threshold = app.config['PROFILE_THRESHOLD']
+        self.profile_interval = app.config['PROFILE_INTERVAL']
+        self.profile_folder = app.config['PROFILE_FOLDER']
+
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.active = {}
+        self.sampler = None
+        self.durations = defaultdict(lambda: Histogram(self.buckets))
+        self.requests = defaultdict(int)
+        self.part_seconds = defaultdict(float)
+        self.statements = defaultdict(int)
+        self.slow_queries = defaultdict(int)
+
+        if not self.enabled:
+            return
+        app.before_request(self.start_request)
+        app.after_request(self.record_status)
+        # streamed responses run queries after the view returns, the
+        # request ends when its context is torn down
+        app.teardown_request(self.end_request)
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self.before_execute)
+            event.listen(engine, 'after_cursor_execute', self.after_execute)
+        app.jinja_env.template_class = self.template_class()
+        for name in HTTP_METHODS:
+            setattr(oauth, name, self.timed('http', getattr(oauth, name)))
+
+    def current(self):
+        """ Return the timings of the request running in this thread """
+        return getattr(self.local, 'timings', None)
+
+    def start_request(self):
+        timings = RequestTimings(request.endpoint)
+        self.local.timings = timings
+        if self.profile_threshold is not None:
+            self.start_sampler()
+            with self.lock:
+                self.active[threading.current_thread().ident] = timings
+
+    def record_status(self, response):
+        timings = self.current()
+        if timings is not None:
+            timings.status = response.status_code
+        return response
+
+    def end_request(self, exception=None):
+        timings = self.current()
+        if timings is None:
+            return
+        self.local.timings = None
+        elapsed = time.time() - timings.started
+        status = timings.status or 500
+        endpoint = timings.endpoint or 'none'
+        with self.lock:
+            self.active.pop(threading.current_thread().ident, None)
+            self.durations[endpoint].observe(elapsed)
+            self.requests[endpoint, status] += 1
+            self.statements[endpoint] += timings.statements
+            for part in PARTS:
+                self.part_seconds[endpoint, part] += timings.seconds[part]
+        if self.profile_threshold is not None and \
+                elapsed >= self.profile_threshold and timings.samples:
+            self.write_profile(timings, elapsed)
+
+    def before_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        conn.info.setdefault('query_started', []).append(time.time())
+
+    def after_execute(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        elapsed = time.time() - conn.info['query_started'].pop()
+        timings = self.current()
+        if timings is not None:
+            timings.statements += 1
+            timings.seconds['db'] += elapsed
+        if elapsed >= self.slow_query:
+            endpoint = timings.endpoint if timings is not None else None
+            with self.lock:
+                self.slow_queries[endpoint or 'none'] += 1
+            self.app.logger.warning('Slow query (%.3f s) in %s: %s',
+                                    elapsed, endpoint or 'no request',
+                                    ' '.join(statement.split()))
+
+    def timed(self, part, function):
+        """ Wrap function so its time counts towards part of the request """
+        def timed_function(*args, **kwargs):
+            timings = self.current()
+            started = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if timings is not None:
+                    timings.seconds[part] += time.time() - started
+        return timed_function
+
+    def template_class(self):
+        """ Return a Jinja template class that times rendering """
+        instrumentation = self
+
+        class TimedTemplate(Template):
+            def render(self, *args, **kwargs):
+                return instrumentation.timed('template', Template.render)(
+                    self, *args, **kwargs)
+
+        return TimedTemplate
+
+    # Sampling profiler
+
+    def start_sampler(self):
+        """ Start the sampling thread, in the process serving requests """
+        if self.sampler is None:
+            with self.lock:
+                if self.sampler is None:
+                    self.sampler = threading.Thread(target=self.sample)
+                    self.sampler.daemon = True
+                    self.sampler.start()
+
+    def sample(self):
+        """ Record the stacks of threads serving requests, forever """
+        while True:
+            time.sleep(self.profile_interval)
+            with self.lock:
+                active = self.active.items()
+            frames = sys._current_frames()
+            for ident, timings in active:
+                frame = frames.get(ident)
+                if frame is not None:
+                    timings.samples[collapse(frame)] += 1
+
+    def write_profile(self, timings, elapsed):
+        """ Write the request's stacks in collapsed format """
+        if not os.path.isdir(self.profile_folder):
+            os.makedirs(self.profile_folder)
+        path = os.path.join(self.profile_folder, '%s-%d-%dms.folded' % (
+            timings.endpoint or 'none', timings.started * 1000,
+            elapsed * 1000))
+        with open(path, 'w') as f:
+            for stack, count in sorted(timings.samples.items()):
+                f.write('%s %d\n' % (stack, count))
+
+    # Prometheus export
+
+    def metrics(self):
+        """ Return the collected metrics in Prometheus text format """
+        lines = []
+        with self.lock:
+            lines.append('# HELP catalog_request_duration_seconds '
+                         'Request duration by endpoint.')
+            lines.append('# TYPE catalog_request_duration_seconds histogram')
+            for endpoint, histogram in sorted(self.durations.items()):
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(
+                        'catalog_request_duration_seconds_bucket'
+                        '{endpoint="%s",le="%s"} %d' % (
+                            endpoint, bound, count))
+                lines.append('catalog_request_duration_seconds_bucket'
+                             '{endpoint="%s",le="+Inf"} %d' % (
+                                 endpoint, histogram.count))
+                lines.append('catalog_request_duration_seconds_sum'
+                             '{endpoint="%s"} %.6f' % (
+                                 endpoint, histogram.sum))
+                lines.append('catalog_request_duration_seconds_count'
+                             '{endpoint="%s"} %d' % (
+                                 endpoint, histogram.count))
+            lines.extend(counter(
+                'catalog_requests_total', 'Requests by endpoint and status.',
+                ('endpoint', 'status'), self.requests))
+            lines.extend(counter(
+                'catalog_request_part_seconds_total',
+                'Request time spent in SQL, templates and HTTP calls.',
+                ('endpoint', 'part'), self.part_seconds))
+            lines.extend(counter(
+                'catalog_db_statements_total', 'SQL statements executed.',
+                ('endpoint',), self.statements))
+            lines.extend(counter(
+                'catalog_slow_queries_total', 'SQL statements slower than '
+                'SLOW_QUERY_THRESHOLD.', ('endpoint',), self.slow_queries))
+        return '\n'.join(lines) + '\n'
+
+
+def collapse(frame):
+    """ Return a stack as 'outer;...;inner' function names """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (code.co_name,
+                                     os.path.basename(code.co_filename),
+                                     code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def counter(name, description, labels, values):
+    """ Return the lines of a Prometheus counter """
+    lines = ['# HELP %s %s' % (name, description), '# TYPE %s counter' % name]
+    for key, value in sorted(values.items()):
+        if not isinstance(key, tuple):
+            key = (key,)
+        lines.append('%s{%s} %s' % (name, ','.join(
+            '%s="%s"' % pair for pair in zip(labels, key)), value))
+    return lines
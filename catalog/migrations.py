@@ -0,0 +1,159 @@
+"""
+    Versioned schema migrations.
+    Upgrade an existing catalog database in place.
+
+    pysqlite commits before every DDL statement, so a migration is not
+    atomic. Each one checks for what it creates instead, and can be run
+    again after it failed part way.
+"""
+
+from catalog import search
+from catalog.models import Item, reconcile_item_counts
+from sqlalchemy import Table, Column, Integer, MetaData
+from sqlalchemy.schema import CreateTable
+
+
+metadata = MetaData()
+
+# single row table holding the number of the last applied migration
+schema_version = Table('schema_version', metadata,
+                       Column('version', Integer, nullable=False))
+
+# migrations in the order they are applied; version N is MIGRATIONS[N - 1]
+MIGRATIONS = []
+
+# publication date given to items that had none, so they are listed last
+UNKNOWN_PUB_DATE = '1970-01-01 00:00:00.000000'
+
+
+def migration(func):
+    """ Register a migration function taking a database connection """
+    MIGRATIONS.append(func)
+    return func
+
+
+@migration
+def add_lookup_indexes(connection):
+    """ Index item publication dates and the user and category keys """
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_item_pub_date '
+                       'ON item (pub_date)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_item_user_id '
+                       'ON item (user_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_category_user_id '
+                       'ON category (user_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS '
+                       'ix_item_category_id_pub_date '
+                       'ON item (category_id, pub_date)')
+
+
+@migration
+def add_item_search_index(connection):
+    """ Create and fill the item full text search index """
+    search.create_index(connection)
+
+
+@migration
+def add_item_image_variants(connection):
+    """ Record the resized variants of item images """
+    add_column(connection, 'item', 'image_variants', 'VARCHAR(1000)')
+
+
+@migration
+def add_category_item_count(connection):
+    """ Count the items of every category """
+    add_column(connection, 'category', 'item_count',
+               'INTEGER NOT NULL DEFAULT 0')
+    reconcile_item_counts(connection)
+
+
+@migration
+def add_item_image_index(connection):
+    """ Index item images, looked up by the upload sweeper """
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_item_image '
+                       'ON item (image)')
+
+
+@migration
+def require_item_pub_date(connection):
+    """ Date the items without a publication date, and make it required.
+
+    SQLite cannot change a column, so the item table is copied into a new
+    one, which then takes its name, and its indexes and triggers are made
+    again. A copy left by a failed run is made again, or renamed if the
+    item table is already gone.
+    """
+    pub_date = column_info(connection, 'item', 'pub_date')
+    if pub_date is not None and not pub_date.notnull:
+        connection.execute('DROP TABLE IF EXISTS item_rebuild')
+        create = str(CreateTable(Item.__table__).compile(
+            dialect=connection.dialect))
+        connection.execute(create.replace('CREATE TABLE item ',
+                                          'CREATE TABLE item_rebuild ', 1))
+        columns = [column.name for column in Item.__table__.columns]
+        connection.execute(
+            'INSERT INTO item_rebuild (%s) SELECT %s FROM item' % (
+                ', '.join(columns),
+                ', '.join("COALESCE(pub_date, '%s')" % UNKNOWN_PUB_DATE
+                          if name == 'pub_date' else name
+                          for name in columns)))
+        connection.execute('DROP TABLE item')
+    if pub_date is None or not pub_date.notnull:
+        connection.execute('ALTER TABLE item_rebuild RENAME TO item')
+    add_lookup_indexes(connection)
+    add_item_image_index(connection)
+    search.create_index(connection)
+
+
+def column_info(connection, table, column):
+    """ Return the PRAGMA table_info row of a column, or None """
+    rows = connection.execute('PRAGMA table_info(%s)' % table)
+    # no result at all when there is no such table
+    if not rows.returns_rows:
+        return None
+    for row in rows:
+        if row.name == column:
+            return row
+    return None
+
+
+def add_column(connection, table, column, definition):
+    """ Add a column to table, unless it has one of that name """
+    if column_info(connection, table, column) is None:
+        connection.execute('ALTER TABLE %s ADD COLUMN %s %s'
+                           % (table, column, definition))
+
+
+def latest_version():
+    """ Return the version a fully migrated database is at """
+    return len(MIGRATIONS)
+
+
+def current_version(connection):
+    """ Return the database's schema version, 0 if it was never migrated """
+    if not schema_version.exists(bind=connection):
+        return 0
+    version = connection.execute(schema_version.select()).scalar()
+    return version or 0
+
+
+def stamp(connection, version):
+    """ Record version as the database's schema version """
+    schema_version.create(bind=connection, checkfirst=True)
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert(), version=version)
+
+
+def upgrade(engine):
+    """ Apply pending migrations, stamping the version after each.
+
+    Returns the list of (version, migration name) applied.
+    """
+    applied = []
+    with engine.connect() as connection:
+        version = current_version(connection)
+        for number, func in enumerate(MIGRATIONS[version:], version + 1):
+            with connection.begin():
+                func(connection)
+                stamp(connection, number)
+            applied.append((number, func.__name__))
+    return applied
@@ -1,9 +1,11 @@
 """ 
 SQLAlchemy database model for the application.
 """
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Index
+from sqlalchemy import event, func, select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import get_history
 
 
 Base = declarative_base()
@@ -27,7 +29,10 @@ class Category(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False, unique=True)
-    user_id = Column(Integer, ForeignKey('user.id'))
+    user_id = Column(Integer, ForeignKey('user.id'), index=True)
+    # number of items in the category, kept up to date on item writes
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default='0')
     user = relationship(User)
     items = relationship("Item", cascade="all,delete", backref="category")
 
@@ -45,16 +50,26 @@ class Item(Base):
     """ Item model """
 
     __tablename__ = 'item'
+    __table_args__ = (
+        # per-category listings, newest first
+        Index('ix_item_category_id_pub_date', 'category_id', 'pub_date'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False, unique=True)
     description = Column(String(1000))
-    pub_date = Column(DateTime)
-    image = Column(String(250))
+    pub_date = Column(DateTime, nullable=False, index=True)
+    image = Column(String(250), index=True)
+    # comma separated file names of the resized image variants
+    image_variants = Column(String(1000))
     category_id = Column(Integer, ForeignKey('category.id'))
-    user_id = Column(Integer, ForeignKey('user.id'))
+    user_id = Column(Integer, ForeignKey('user.id'), index=True)
     user = relationship(User)
 
+    def image_variant(self, variant):
+        """ Return the file name of an image variant, such as 'thumb' """
+        return image_variant(self.image, self.image_variants, variant)
+
     @property
     def serialize(self):
         return {
@@ -66,3 +81,56 @@ class Item(Base):
             'image': self.image,
             'pub_date': self.pub_date.strftime('%a, %d %b %Y %H:%M:%S GMT')
         }
+
+
+def image_variant(image, image_variants, variant):
+    """ Return the file name of a variant of image, given an item's
+    image_variants column.
+
+    Falls back to the original image until the variant is generated.
+    """
+    for filename in (image_variants or '').split(','):
+        # variant file names look like <original name>.<variant>.<ext>
+        parts = filename.rsplit('.', 2)
+        if len(parts) == 3 and parts[1] == variant:
+            return filename
+    return image
+
+
+def count_items(connection, category_id, delta):
+    """ Add delta to a category's item count """
+    if category_id is not None:
+        category = Category.__table__
+        connection.execute(category.update()
+                           .where(category.c.id == category_id)
+                           .values(item_count=category.c.item_count + delta))
+
+
+def reconcile_item_counts(connection):
+    """ Recompute every category's item count in one statement """
+    category, item = Category.__table__, Item.__table__
+    connection.execute(category.update().values(item_count=select(
+        [func.count(item.c.id)]).where(item.c.category_id == category.c.id)
+        .as_scalar()))
+
+
+# item counts are updated in the flush that writes the item, so they
+# commit or roll back with it
+
+@event.listens_for(Item, 'after_insert')
+def item_inserted(mapper, connection, item):
+    count_items(connection, item.category_id, 1)
+
+
+@event.listens_for(Item, 'after_update')
+def item_updated(mapper, connection, item):
+    history = get_history(item, 'category_id')
+    if history.added and history.deleted:
+        # the item moved to another category
+        count_items(connection, history.deleted[0], -1)
+        count_items(connection, history.added[0], 1)
+
+
+@event.listens_for(Item, 'after_delete')
+def item_deleted(mapper, connection, item):
+    count_items(connection, item.category_id, -1)
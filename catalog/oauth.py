@@ -0,0 +1,156 @@
+"""
+    HTTP client for the Google and Facebook OAuth providers.
+
+    Provider secrets are read once at startup, requests share pooled
+    connections and are bounded by timeouts, and independent calls can be
+    made concurrently. StubOAuthClient answers with canned responses so
+    the login flow can run without reaching the providers.
+"""
+
+from multiprocessing.pool import ThreadPool
+from oauth2client.client import OAuth2WebServerFlow
+from requests.adapters import HTTPAdapter, BaseAdapter
+import httplib2
+import json
+import requests
+import threading
+
+
+GOOGLE_TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo'
+GOOGLE_USERINFO_URL = 'https://www.googleapis.com/oauth2/v1/userinfo'
+GOOGLE_REVOKE_URL = 'https://accounts.google.com/o/oauth2/revoke'
+FACEBOOK_TOKEN_URL = 'https://graph.facebook.com/oauth/access_token'
+FACEBOOK_ME_URL = 'https://graph.facebook.com/v2.5/me'
+FACEBOOK_PICTURE_URL = 'https://graph.facebook.com/v2.5/me/picture'
+FACEBOOK_PERMISSIONS_URL = 'https://graph.facebook.com/%s/permissions'
+
+
+def load_secrets(path):
+    """ Return the 'web' section of a client secrets file """
+    with open(path) as f:
+        return json.load(f)['web']
+
+
+class OAuthClient(object):
+    """ Pooled, time limited HTTP client for the OAuth providers """
+
+    def __init__(self, google_secrets, facebook_secrets, timeout,
+                 pool_size, workers):
+        self.google = google_secrets
+        self.facebook = facebook_secrets
+        self.timeout = timeout
+        self.workers = workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        """ Threads for concurrent calls, started on first use """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            return self._pool
+
+    def request(self, method, url, params=None):
+        """ Make a request, raising requests.RequestException on failure
+        or when the provider does not answer within the timeout """
+        return self.session.request(method, url, params=params,
+                                    timeout=self.timeout)
+
+    def get_json(self, url, params=None):
+        """ GET a URL and decode its JSON response """
+        return self.request('GET', url, params).json()
+
+    def get_all_json(self, *calls):
+        """ GET several (url, params) calls concurrently, returning their
+        decoded JSON responses in order """
+        return self.pool.map(lambda call: self.get_json(*call), calls)
+
+    def exchange_google_code(self, code):
+        """ Upgrade a Google authorization code into credentials.
+
+        Raises oauth2client's FlowExchangeError if the code is rejected.
+        """
+        flow = OAuth2WebServerFlow(
+            client_id=self.google['client_id'],
+            client_secret=self.google['client_secret'],
+            scope='',
+            redirect_uri='postmessage',
+            auth_uri=self.google['auth_uri'],
+            token_uri=self.google['token_uri'])
+        # httplib2 connections cannot be shared between threads
+        return flow.step2_exchange(
+            code, http=httplib2.Http(timeout=self.timeout[1]))
+
+
+class StubCredentials(object):
+    """ Credentials returned by the stub Google code exchange """
+
+    def __init__(self, access_token, user_id):
+        self.access_token = access_token
+        self.id_token = {'sub': user_id}
+
+
+class StubAdapter(BaseAdapter):
+    """ requests adapter answering with canned responses by URL """
+
+    def __init__(self, responses):
+        super(StubAdapter, self).__init__()
+        self.responses = responses
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        body = self.responses.get(request.url.split('?')[0])
+        response.status_code = 200 if body is not None else 404
+        response._content = body or ''
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class StubOAuthClient(OAuthClient):
+    """ OAuth client answering like the providers, without the network """
+
+    USER = {'id': 'stub-user', 'name': 'Stub User',
+            'email': 'stub.user@example.com',
+            'picture': 'https://example.com/stub-user.png'}
+
+    def __init__(self, *args, **kwargs):
+        super(StubOAuthClient, self).__init__(*args, **kwargs)
+        user = self.USER
+        adapter = StubAdapter({
+            GOOGLE_TOKENINFO_URL: json.dumps({
+                'user_id': user['id'],
+                'issued_to': self.google['client_id']}),
+            GOOGLE_USERINFO_URL: json.dumps(user),
+            GOOGLE_REVOKE_URL: '',
+            FACEBOOK_TOKEN_URL: 'access_token=stub-token&expires=5183999',
+            FACEBOOK_ME_URL: json.dumps(user),
+            FACEBOOK_PICTURE_URL: json.dumps(
+                {'data': {'url': user['picture']}}),
+            FACEBOOK_PERMISSIONS_URL % user['id']: json.dumps(
+                {'success': True}),
+        })
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def exchange_google_code(self, code):
+        return StubCredentials('stub-token', self.USER['id'])
+
+
+def make_oauth_client(config):
+    """ Create the OAuth client described by the OAUTH_* settings """
+    client_class = StubOAuthClient if config['OAUTH_STUB'] else OAuthClient
+    return client_class(
+        load_secrets(config['GOOGLE_CLIENT_SECRETS']),
+        load_secrets(config['FACEBOOK_CLIENT_SECRETS']),
+        config['OAUTH_TIMEOUT'], config['OAUTH_POOL_SIZE'],
+        config['OAUTH_WORKERS'])
@@ -0,0 +1,71 @@
+"""
+    Keyset pagination of item listings, newest first.
+
+    A page is found by seeking to the (pub_date, id) of the last item
+    shown rather than by skipping rows with OFFSET, so every page costs
+    one index range scan however deep into a listing it is. Cursors are
+    opaque strings naming an item's position in the listing.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import literal, tuple_
+
+
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+# rows of a page and the cursors of the pages after and before it, or None
+Page = namedtuple('Page', 'rows next prev')
+
+
+def encode_cursor(pub_date, id):
+    """ Return the cursor of the item published at pub_date with id """
+    return '%s.%d' % (pub_date.strftime(CURSOR_DATE_FORMAT), id)
+
+
+def decode_cursor(cursor):
+    """ Return the (pub_date, id) of a cursor, raising ValueError when
+    it is malformed """
+    pub_date, id = cursor.split('.')
+    return datetime.strptime(pub_date, CURSOR_DATE_FORMAT), int(id)
+
+
+def keyset_page(query, pub_date, id, limit, after=None, before=None,
+                key=None):
+    """ Return a Page of query's rows, newest first.
+
+    pub_date and id are the columns the listing is ordered by. With the
+    after cursor the page holds the items that follow it, with before the
+    items that precede it, otherwise the first items. key returns the
+    (pub_date, id) of a row and defaults to its pub_date and id attributes.
+    """
+    key = key or (lambda row: (row.pub_date, row.id))
+    position = tuple_(pub_date, id)
+    if before is not None:
+        before = decode_cursor(before)
+        query = query.filter(position > tuple_(
+            literal(before[0], pub_date.type), literal(before[1], id.type)))
+        query = query.order_by(pub_date.asc(), id.asc())
+    else:
+        if after is not None:
+            after = decode_cursor(after)
+            query = query.filter(position < tuple_(
+                literal(after[0], pub_date.type), literal(after[1], id.type)))
+        query = query.order_by(pub_date.desc(), id.desc())
+
+    # one row more than the page tells whether there is another page
+    rows = query.limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+        has_next, has_prev = True, more
+    else:
+        has_next, has_prev = more, after is not None
+
+    next = prev = None
+    if rows and has_next:
+        next = encode_cursor(*key(rows[-1]))
+    if rows and has_prev:
+        prev = encode_cursor(*key(rows[0]))
+    return Page(rows, next, prev)
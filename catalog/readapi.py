@@ -0,0 +1,212 @@
+"""
+    Read-only API for serving many concurrent clients from one process.
+
+    The catalog JSON, the Atom feeds and the category and item lookups
+    are answered by a small app of their own, without sessions, templates
+    or CSRF, mounted at READ_API_PREFIX next to the main app. Served by
+    serve_reads.py under gevent, every connection is a greenlet, and the
+    queries run in a pool of threads, so a slow client or query holds up
+    only its own request. Responses have the same shapes as the main app's.
+
+    Reads go to a replica when there are any. The API serves anonymous
+    clients, so there is no reading of one's own writes.
+"""
+
+from catalog.api import item_fields, item_selection, item_columns, item_dict
+from catalog.api import api_response, cursor_args
+from catalog.models import User, Category, Item
+from catalog.pagination import keyset_page
+from catalog.serving import compress_response
+from datetime import datetime
+from flask import Flask, Response, request, abort, url_for
+from sqlalchemy.orm import sessionmaker
+from werkzeug.contrib.atom import AtomFeed
+from werkzeug.urls import url_quote
+import json
+
+try:
+    from gevent.threadpool import ThreadPool
+except ImportError:
+    ThreadPool = None
+
+
+class ReadAPI(object):
+    """ WSGI app serving the read-only API """
+
+    def __init__(self, config, router):
+        self.router = router
+        self.threadpool = None
+        self.Session = sessionmaker()
+        self.app = Flask(__name__, static_folder=None)
+        self.app.config.update(config)
+        self.app.after_request(compress_response)
+        for rule, view in [
+                ('/catalog/json', self.catalog_json),
+                ('/catalog/recent.atom', self.catalog_atom),
+                ('/category/<name>/recent.atom', self.category_atom),
+                ('/category/<name>/json', self.category_json),
+                ('/item/<name>/json', self.item_json)]:
+            self.app.add_url_rule(rule, view.__name__, view)
+
+    def __call__(self, environ, start_response):
+        return self.app(environ, start_response)
+
+    def use_threadpool(self, size):
+        """ Run queries in a pool of size threads, when serving under
+        gevent. Otherwise they run in the thread serving the request. """
+        if ThreadPool is None:
+            raise RuntimeError('the read API thread pool needs gevent')
+        self.threadpool = ThreadPool(size)
+
+    def run(self, func, *args):
+        """ Return func(session, *args), called with a database session """
+        if self.threadpool is None:
+            return self.call(func, args)
+        return self.threadpool.apply(self.call, (func, args))
+
+    def call(self, func, args):
+        if self.router.replicas:
+            engine = self.router.replica()
+        else:
+            engine = self.router.primary
+        session = self.Session(bind=engine)
+        try:
+            return func(session, *args)
+        finally:
+            session.close()
+
+    def catalog_json(self):
+        """ Return catalog items in JSON format, as /catalog/json does """
+        config = self.app.config
+        after = request.args.get('after', 0, type=int)
+        limit = request.args.get('limit', config['JSON_PAGE_SIZE'], type=int)
+        limit = max(1, min(limit, config['JSON_PAGE_SIZE_MAX']))
+        fields = item_fields()
+        selection = item_selection(fields, 'id')
+        # rows are the category's id, name and user_id, then the item fields
+        item_id = 3 + selection.index('id')
+
+        categories = []
+        for row in self.run(catalog_rows, after, limit, selection):
+            if not categories or categories[-1]['id'] != row[0]:
+                categories.append({'id': row[0], 'name': row[1],
+                                   'user_id': row[2], 'items': []})
+            if row[item_id] is not None:
+                categories[-1]['items'].append(item_dict(row, fields, 3))
+        document = {'categories': categories}
+        if len(categories) == limit:
+            document['next'] = categories[-1]['id']
+        return Response(json.dumps(document), mimetype='application/json')
+
+    def catalog_atom(self):
+        """ Return latest items in Atom format """
+        return self.atom_feed('Recent Items', None)
+
+    def category_atom(self, name):
+        """ Return latest items of a category in Atom format """
+        return self.atom_feed('Recent %s Items' % name, name)
+
+    def atom_feed(self, title, category):
+        """ Return an Atom feed of the latest items, of the named category
+        if there is one, with ?since=<YYYY-MM-DDTHH:MM:SSZ> """
+        since = request.args.get('since')
+        if since is not None:
+            try:
+                since = datetime.strptime(since, '%Y-%m-%dT%H:%M:%SZ')
+            except ValueError:
+                abort(400)
+        items = self.run(feed_rows, category, since,
+                         self.app.config['FEED_SIZE'])
+        if items is None:
+            abort(404)
+
+        feed = AtomFeed(title, url=request.host_url,
+                        feed_url=url_for(request.endpoint, _external=True,
+                                         **request.view_args))
+        for name, description, pub_date, author in items:
+            feed.add(name, description,
+                     content_type='html',
+                     author=author,
+                     url='/item/%s' % url_quote(name),
+                     updated=pub_date,
+                     published=pub_date)
+        response = feed.get_response()
+        if items:
+            response.last_modified = items[0].pub_date
+        return response
+
+    def category_json(self, name):
+        """ Return a page of a category's items in JSON format, as
+        /category/<name>/json does """
+        config = self.app.config
+        after, before = cursor_args()
+        limit = request.args.get('limit', config['CATEGORY_PAGE_SIZE'],
+                                 type=int)
+        limit = max(1, min(limit, config['JSON_PAGE_SIZE_MAX']))
+        fields = item_fields()
+        found = self.run(category_page, name, fields, limit, after, before)
+        if found is None:
+            abort(404)
+
+        category, page = found
+        return api_response(id=category.id, name=category.name,
+                            user_id=category.user_id,
+                            count=category.item_count,
+                            items=[item_dict(row, fields) for row in page.rows],
+                            next=page.next, prev=page.prev)
+
+    def item_json(self, name):
+        """ Return an item in JSON format, as /item/<name>/json does """
+        fields = item_fields()
+        row = self.run(item_row, name, fields)
+        if row is None:
+            abort(404)
+        return api_response(**item_dict(row, fields))
+
+
+def catalog_rows(session, after, limit, selection):
+    """ Return the categories after the id after, limit of them, with the
+    selected fields of their items """
+    page = session.query(Category.id).filter(Category.id > after) \
+        .order_by(Category.id).limit(limit).subquery()
+    return session.query(Category.id, Category.name, Category.user_id,
+                         *item_columns(selection)) \
+        .outerjoin(Item, Item.category_id == Category.id) \
+        .filter(Category.id.in_(page)) \
+        .order_by(Category.id, Item.id).all()
+
+
+def feed_rows(session, category, since, size):
+    """ Return the latest items of the named category, or of all, or None
+    when there is no such category """
+    query = session.query(Item.name, Item.description, Item.pub_date,
+                          User.name).join(User, Item.user_id == User.id)
+    if category is not None:
+        category_id = session.query(Category.id) \
+            .filter_by(name=category).scalar()
+        if category_id is None:
+            return None
+        query = query.filter(Item.category_id == category_id)
+    if since is not None:
+        query = query.filter(Item.pub_date > since)
+    return query.order_by(Item.pub_date.desc(), Item.id.desc()) \
+        .limit(size).all()
+
+
+def category_page(session, name, fields, limit, after, before):
+    """ Return the named category and a Page of its items, or None """
+    category = session.query(Category.id, Category.name, Category.user_id,
+                             Category.item_count).filter_by(name=name).first()
+    if category is None:
+        return None
+    page = keyset_page(
+        session.query(*item_columns(item_selection(fields, 'pub_date', 'id')))
+        .filter(Item.category_id == category.id),
+        Item.pub_date, Item.id, limit, after, before)
+    return category, page
+
+
+def item_row(session, name, fields):
+    """ Return the selected fields of the named item, or None """
+    return session.query(*item_columns(fields)) \
+        .filter(Item.name == name).first()
@@ -0,0 +1,169 @@
+"""
+    Read/write routing between the primary database and read replicas.
+
+    Queries run while serving GET and HEAD requests go to a replica, and
+    everything else, including every flush, goes to the primary. After a
+    request writes to the database, the user's later requests read from
+    the primary for a while, so they see their own changes before the
+    replicas catch up. Values loaded into a cache shared by every user are
+    read from the primary too, see primary_reads.
+"""
+
+from catalog.database import make_engine
+from contextlib import contextmanager
+from flask import has_request_context, request, session
+from itertools import cycle
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session
+import os
+import sqlite3
+import threading
+import time
+
+
+READ_METHODS = ('GET', 'HEAD')
+
+# session key holding the time until which the user reads from the primary
+PRIMARY_UNTIL = '_primary_until'
+
+# weight of the latest query in a replica's moving average latency
+LATENCY_WEIGHT = 0.2
+
+
+class ReplicaRouter(object):
+    """ Picks the engine a query runs on """
+
+    def __init__(self, primary, replicas, selection, sticky_seconds):
+        self.primary = primary
+        self.replicas = replicas
+        self.selection = selection
+        self.sticky_seconds = sticky_seconds
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.next_replica = cycle(replicas)
+        self.latency = dict((replica, 0.0) for replica in replicas)
+        if selection == 'least-latency':
+            for replica in replicas:
+                event.listen(replica, 'before_cursor_execute',
+                             self.before_execute)
+                event.listen(replica, 'after_cursor_execute',
+                             self.after_execute(replica))
+
+    @property
+    def engines(self):
+        return [self.primary] + self.replicas
+
+    def use_replica(self):
+        """ True when the current request may read from a replica """
+        return (bool(self.replicas) and has_request_context() and
+                request.method in READ_METHODS and
+                not getattr(self.local, 'primary', False) and
+                session.get(PRIMARY_UNTIL, 0) < time.time())
+
+    @contextmanager
+    def primary_reads(self):
+        """ Read from the primary within the block, in this thread.
+
+        A replica that has not caught up with a write would otherwise
+        fill the cache with data older than the version it is kept under.
+        """
+        previous = getattr(self.local, 'primary', False)
+        self.local.primary = True
+        try:
+            yield
+        finally:
+            self.local.primary = previous
+
+    def replica(self):
+        """ Return the replica to read from """
+        if self.selection == 'least-latency':
+            return min(self.replicas, key=self.latency.get)
+        with self.lock:
+            return next(self.next_replica)
+
+    def before_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        conn.info.setdefault('replica_started', []).append(time.time())
+
+    def after_execute(self, replica):
+        def after_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+            elapsed = time.time() - conn.info['replica_started'].pop()
+            self.latency[replica] += \
+                LATENCY_WEIGHT * (elapsed - self.latency[replica])
+        return after_execute
+
+
+class RoutingSession(Session):
+    """ Session reading from a replica during read-only requests.
+
+    A session keeps to one replica until it is closed, so the queries of
+    a request see the same copy of the database.
+    """
+
+    def __init__(self, router=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.router = router
+        self.replica = None
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or not self.router.use_replica():
+            return self.router.primary
+        if self.replica is None:
+            self.replica = self.router.replica()
+        return self.replica
+
+    def close(self):
+        super(RoutingSession, self).close()
+        self.replica = None
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def read_your_writes(db_session):
+    """ Send the user's reads to the primary after a request writes """
+    if has_request_context() and request.method not in READ_METHODS:
+        session[PRIMARY_UNTIL] = time.time() + db_session.router.sticky_seconds
+
+
+def make_router(config, primary):
+    """ Create the router for the primary engine and the replicas of the
+    DATABASE_REPLICA_* settings """
+    replicas = [make_engine(config, uri, replica=True)
+                for uri in config['DATABASE_REPLICA_URIS']]
+    return ReplicaRouter(primary, replicas,
+                         config['DATABASE_REPLICA_SELECTION'],
+                         config['READ_YOUR_WRITES_SECONDS'])
+
+
+def copy_sqlite(source, target):
+    """ Replace the SQLite database file target with a consistent copy of
+    source, taken while it stays in use """
+    temporary = target + '.copy'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    connection = sqlite3.connect(source)
+    try:
+        connection.execute('VACUUM INTO ?', (temporary,))
+    finally:
+        connection.close()
+    # replicas are read only, they need no write-ahead log
+    connection = sqlite3.connect(temporary)
+    try:
+        connection.execute('PRAGMA journal_mode=DELETE')
+    finally:
+        connection.close()
+    os.rename(temporary, target)
+
+
+def sync_replicas(config):
+    """ Refresh the SQLite replicas with copies of the primary database.
+    Returns the replica files written. """
+    source = make_url(config['DATABASE_URI']).database
+    written = []
+    for uri in config['DATABASE_REPLICA_URIS']:
+        url = make_url(uri)
+        if url.drivername.startswith('sqlite'):
+            copy_sqlite(source, url.database)
+            written.append(url.database)
+    return written
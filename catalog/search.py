@@ -0,0 +1,105 @@
+"""
+    Full text item search backed by an SQLite FTS5 index.
+
+    item_fts indexes the name and description of every item. It is an
+    external content table over item, kept in sync by triggers, so writes
+    from the views and bulk loads are indexed alike.
+"""
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+import re
+
+
+# snippet highlight markers, replaced by <mark> tags after escaping
+MARK_OPEN = u'\x02'
+MARK_CLOSE = u'\x03'
+
+CREATE_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+    "name, description, content='item', content_rowid='id', "
+    "prefix='2 3 4')",
+    # rank name matches ten times higher than description matches
+    "INSERT INTO item_fts(item_fts, rank) "
+    "VALUES ('rank', 'bm25(10.0, 1.0)')",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item "
+    "BEGIN "
+    "INSERT INTO item_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item "
+    "BEGIN "
+    "INSERT INTO item_fts(item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_update "
+    "AFTER UPDATE OF name, description ON item "
+    "BEGIN "
+    "INSERT INTO item_fts(item_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO item_fts(rowid, name, description) "
+    "VALUES (new.id, new.name, new.description); "
+    "END",
+    # index the rows already in the item table
+    "INSERT INTO item_fts(item_fts) VALUES ('rebuild')",
+]
+
+# ordering by the rank column lets FTS5 sort matches internally
+SEARCH = text(
+    "SELECT item.id, item.name, "
+    "snippet(item_fts, -1, :open, :close, '...', 16) AS snippet "
+    "FROM item_fts JOIN item ON item.id = item_fts.rowid "
+    "WHERE item_fts MATCH :match "
+    "ORDER BY rank "
+    "LIMIT :limit OFFSET :offset")
+
+
+def create_index(connection):
+    """ Create the item_fts index and its triggers, and fill it """
+    for statement in CREATE_INDEX:
+        connection.execute(statement)
+
+
+def suspend_index(connection):
+    """ Stop updating the index until create_index is run again and
+    rebuilds it. The delete and update triggers go too: removing a row
+    that was never indexed from an external content index corrupts it. """
+    for trigger in ('item_fts_insert', 'item_fts_delete', 'item_fts_update'):
+        connection.execute("DROP TRIGGER IF EXISTS %s" % trigger)
+
+
+def match_expression(query):
+    """ Turn user input into an FTS5 query requiring every term.
+
+    The last term is matched as a prefix, so results follow the user's
+    typing; the others must match whole words.
+    """
+    terms = [u'"%s"' % term
+             for term in re.findall(r'\w+', query, re.UNICODE)]
+    if terms:
+        terms[-1] += u'*'
+    return u' '.join(terms)
+
+
+def highlight(snippet):
+    """ Escape a snippet and wrap matched terms in <mark> tags """
+    return Markup(escape(snippet).replace(MARK_OPEN, Markup(u'<mark>'))
+                  .replace(MARK_CLOSE, Markup(u'</mark>')))
+
+
+def search_items(session, query, limit, offset=0):
+    """ Return items matching query, best first, and whether more exist.
+
+    Each result is a dict with the item id, name and a highlighted
+    snippet of the matching text.
+    """
+    match = match_expression(query)
+    if not match:
+        return [], False
+    rows = session.execute(SEARCH, {
+        'open': MARK_OPEN, 'close': MARK_CLOSE, 'match': match,
+        'limit': limit + 1, 'offset': offset}).fetchall()
+    results = [{'id': row.id, 'name': row.name,
+                'snippet': highlight(row.snippet)}
+               for row in rows[:limit]]
+    return results, len(rows) > limit
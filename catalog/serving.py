@@ -0,0 +1,223 @@
+"""
+    Static and upload file serving, and compression of dynamic responses.
+
+    Supports conditional and Range requests, precompressed .br and .gz
+    sidecar files, offloading the transfer to a front proxy through
+    X-Sendfile or X-Accel-Redirect, and fingerprinted static URLs.
+"""
+
+from flask import current_app, request, abort, Response
+from werkzeug.datastructures import ContentRange
+from werkzeug.security import safe_join
+import gzip
+import hashlib
+import mimetypes
+import os
+import shutil
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# file types that may have precompressed sidecar files
+PRECOMPRESSED = ('.css', '.js', '.svg')
+
+# content encodings, in order of preference, and their sidecar suffixes
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# dynamic response types worth compressing
+COMPRESSIBLE = ('text/html', 'text/plain', 'application/json',
+                'application/x-msgpack', 'application/atom+xml')
+
+CHUNK_SIZE = 64 * 1024
+
+# static file fingerprints, keyed by path and modification time
+_fingerprints = {}
+
+
+def send_static(folder, filename, max_age, immutable=False):
+    """ Return a response serving filename from folder """
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype, direct_passthrough=True)
+
+    if os.path.splitext(filename)[1] in PRECOMPRESSED:
+        response.vary.add('Accept-Encoding')
+        for encoding, suffix in ENCODINGS:
+            if (request.accept_encodings[encoding] and
+                    os.path.isfile(path + suffix)):
+                response.content_encoding = encoding
+                path += suffix
+                filename += suffix
+                break
+
+    stat = os.stat(path)
+    size = stat.st_size
+    response.content_length = size
+    response.last_modified = int(stat.st_mtime)
+    response.set_etag('%d-%d-%s' % (stat.st_mtime, size,
+                                    hashlib.md5(path).hexdigest()[:8]))
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.max_age = \
+            current_app.config['STATIC_IMMUTABLE_MAX_AGE']
+        response.headers['Cache-Control'] += ', immutable'
+
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+
+    # let the front proxy transfer the file, including any ranges
+    location = current_app.config['X_ACCEL_REDIRECT_LOCATIONS'].get(folder)
+    if location is not None:
+        response.headers['X-Accel-Redirect'] = location.rstrip('/') + \
+            '/' + filename
+        return response
+    if current_app.use_x_sendfile:
+        response.headers['X-Sendfile'] = path
+        return response
+
+    start, stop = 0, size
+    if request.range is not None and if_range_matches(response):
+        byte_range = request.range.range_for_length(size)
+        if byte_range is not None:
+            start, stop = byte_range
+            response.status_code = 206
+            response.content_range = ContentRange('bytes', start, stop, size)
+        elif len(request.range.ranges) == 1:
+            # a single range outside the file
+            response.status_code = 416
+            response.headers['Content-Range'] = 'bytes */%d' % size
+            return response
+
+    response.content_length = stop - start
+    response.response = read_file(path, start, stop)
+    return response
+
+
+def if_range_matches(response):
+    """ True unless an If-Range header names another version of the file """
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == response.get_etag()[0]
+    if if_range.date is not None:
+        return response.last_modified <= if_range.date
+    return True
+
+
+def read_file(path, start, stop):
+    """ Yield the bytes of a file from start to stop in chunks """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def fingerprint(folder, filename):
+    """ Return a short hash of a static file's content, or None """
+    path = safe_join(folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
+    key = (path, mtime)
+    if key not in _fingerprints:
+        with open(path, 'rb') as f:
+            _fingerprints[key] = hashlib.md5(f.read()).hexdigest()[:12]
+    return _fingerprints[key]
+
+
+def precompress(folder):
+    """ Write .gz, and .br when brotli is installed, next to every file
+    that may be served precompressed. Returns the files written. """
+    written = []
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            if os.path.splitext(name)[1] not in PRECOMPRESSED:
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as source:
+                with gzip.open(path + '.gz', 'wb', 9) as target:
+                    shutil.copyfileobj(source, target)
+            written.append(path + '.gz')
+            if brotli is not None:
+                with open(path, 'rb') as source:
+                    data = brotli.compress(source.read())
+                with open(path + '.br', 'wb') as target:
+                    target.write(data)
+                written.append(path + '.br')
+    return written
+
+
+def accepted_encoding(mimetype, size):
+    """ Return the encoding to compress a response of mimetype and size
+    bytes with, or None when it should be sent as it is """
+    if mimetype not in COMPRESSIBLE or \
+            size < current_app.config['COMPRESS_MIN_SIZE']:
+        return None
+    for encoding, suffix in ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    """ Return data compressed with a content encoding """
+    level = current_app.config['COMPRESS_LEVEL']
+    if encoding == 'br':
+        # brotli quality runs 0-11, zlib levels 0-9
+        return brotli.compress(data, quality=level)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks):
+    """ Gzip a streamed response body chunk by chunk """
+    compressor = zlib.compressobj(current_app.config['COMPRESS_LEVEL'],
+                                  zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response):
+    """ Compress a dynamic response when the client accepts it.
+
+    Files, already encoded responses and responses with an ETag, which
+    would need one of their own for the compressed body, are left alone.
+    """
+    if (response.status_code != 200 or response.direct_passthrough or
+            response.mimetype not in COMPRESSIBLE or
+            'Content-Encoding' in response.headers or
+            'ETag' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.is_streamed:
+        if request.accept_encodings['gzip']:
+            response.response = compress_stream(response.iter_encoded())
+            response.content_encoding = 'gzip'
+            response.headers.pop('Content-Length', None)
+        return response
+    data = response.get_data()
+    encoding = accepted_encoding(response.mimetype, len(data))
+    if encoding is not None:
+        response.set_data(compress(data, encoding))
+        response.content_encoding = encoding
+    return response
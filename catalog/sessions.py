@@ -0,0 +1,271 @@
+"""
+    Server-side sessions.
+
+    The session cookie only carries an opaque random id; the session data
+    is kept in a store on the server. Stores are an in-memory LRU, a SQLite
+    table, or both, with the memory tier in front of the SQLite one.
+
+    Sessions are read from the store on first use, so requests that never
+    look at the session, such as static files and uploads, cost nothing.
+"""
+
+from catalog.database import make_engine
+from catalog.users import LRUCache
+from datetime import datetime, timedelta
+from flask.sessions import SessionInterface, SessionMixin
+from flask.sessions import session_json_serializer
+from sqlalchemy import MetaData, Table, Column, String, Text, DateTime
+from sqlalchemy import select
+from werkzeug.datastructures import CallbackDict
+from werkzeug.local import LocalProxy
+from werkzeug.utils import import_string
+import binascii
+import os
+import threading
+import time
+
+
+metadata = MetaData()
+
+session_table = Table(
+    'session', metadata,
+    Column('id', String(64), primary_key=True),
+    Column('data', Text, nullable=False),
+    Column('expires', DateTime, nullable=False, index=True),
+)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """ Session data, with the id it is stored under """
+
+    def __init__(self, sid, data=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, data, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class LazySession(LocalProxy):
+    """ Proxy standing in for the session until it is first used """
+
+    def __init__(self, interface, sid):
+        LocalProxy.__init__(self, self._load)
+        object.__setattr__(self, '_interface', interface)
+        object.__setattr__(self, '_sid', sid)
+        object.__setattr__(self, '_session', None)
+
+    def _load(self):
+        if self._session is None:
+            object.__setattr__(self, '_session',
+                               self._interface.load(self._sid))
+        return self._session
+
+    @property
+    def loaded(self):
+        return self._session is not None
+
+
+class MemoryStore(object):
+    """ Sessions kept in process memory, least recently used first out """
+
+    def __init__(self, size):
+        self.entries = LRUCache(size)
+
+    def get(self, sid):
+        entry = self.entries.get(sid)
+        if entry is None:
+            return None
+        data, expires = entry
+        if expires < datetime.utcnow():
+            self.entries.delete(sid)
+            return None
+        return data
+
+    def set(self, sid, data, expires):
+        self.entries.set(sid, (data, expires))
+
+    def delete(self, sid):
+        self.entries.delete(sid)
+
+    def expire(self, batch_size):
+        """ Expired entries are dropped when read, or pushed out """
+        return 0
+
+
+class SQLiteStore(object):
+    """ Sessions kept in a SQLite table, shared by every worker """
+
+    def __init__(self, engine):
+        self.engine = engine
+        metadata.create_all(engine)
+
+    def get(self, sid):
+        row = self.engine.execute(
+            select([session_table.c.data])
+            .where(session_table.c.id == sid)
+            .where(session_table.c.expires >= datetime.utcnow())).first()
+        return row[0] if row is not None else None
+
+    def set(self, sid, data, expires):
+        # the insert replaces an existing session with the same id
+        self.engine.execute(session_table.insert().prefix_with('OR REPLACE'),
+                            id=sid, data=data, expires=expires)
+
+    def delete(self, sid):
+        self.engine.execute(
+            session_table.delete().where(session_table.c.id == sid))
+
+    def expire(self, batch_size):
+        """ Delete expired sessions, batch_size rows per transaction so
+        writers are never held up for long. Returns the number deleted. """
+        expired = select([session_table.c.id]) \
+            .where(session_table.c.expires < datetime.utcnow()) \
+            .limit(batch_size)
+        deleted = 0
+        while True:
+            count = self.engine.execute(session_table.delete().where(
+                session_table.c.id.in_(expired))).rowcount
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+
+class TieredStore(object):
+    """ Memory store in front of a shared store.
+
+    Sessions read from the shared store are kept in memory for at most
+    memory_timeout seconds, so a session changed or ended by another
+    worker is seen within that time.
+    """
+
+    def __init__(self, memory, shared, memory_timeout):
+        self.memory = memory
+        self.shared = shared
+        self.memory_timeout = memory_timeout
+
+    def get(self, sid):
+        data = self.memory.get(sid)
+        if data is None:
+            data = self.shared.get(sid)
+            if data is not None:
+                self.memory.set(sid, data, self.memory_expires())
+        return data
+
+    def set(self, sid, data, expires):
+        self.shared.set(sid, data, expires)
+        self.memory.set(sid, data, min(expires, self.memory_expires()))
+
+    def delete(self, sid):
+        self.memory.delete(sid)
+        self.shared.delete(sid)
+
+    def expire(self, batch_size):
+        return self.shared.expire(batch_size)
+
+    def memory_expires(self):
+        return datetime.utcnow() + timedelta(seconds=self.memory_timeout)
+
+
+class ServerSessionInterface(SessionInterface):
+    """ Flask session interface keeping sessions in a store """
+
+    serializer = session_json_serializer
+
+    def __init__(self, store, expiry_interval, expiry_batch_size,
+                 engines=()):
+        self.store = store
+        # database engines of the store, to dispose of before forking
+        self.engines = list(engines)
+        self.expiry_interval = expiry_interval
+        self.expiry_batch_size = expiry_batch_size
+        self.expiry = None
+        self.lock = threading.Lock()
+
+    def open_session(self, app, request):
+        return LazySession(self, request.cookies.get(app.session_cookie_name))
+
+    def load(self, sid):
+        """ Return the session stored under sid, or a new one """
+        if sid:
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSession(sid, self.serializer.loads(data))
+        return ServerSession(new_session_id(), new=True)
+
+    def regenerate(self, session):
+        """ Move session to a new id and drop the old one from the store,
+        so an id seen before a login or logout is of no use after it """
+        session = session._get_current_object()
+        if not session.new:
+            self.store.delete(session.sid)
+        session.sid = new_session_id()
+        session.new = True
+        session.modified = True
+
+    def save_session(self, app, session, response):
+        if not session.loaded:
+            return
+        session = session._get_current_object()
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                if not session.new:
+                    self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        self.store.set(session.sid, self.serializer.dumps(dict(session)),
+                       datetime.utcnow() + app.permanent_session_lifetime)
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app))
+        self.start_expiry()
+
+    def start_expiry(self):
+        """ Start the expiry thread, in the process serving requests """
+        if self.expiry is None and self.expiry_interval:
+            with self.lock:
+                if self.expiry is None:
+                    self.expiry = threading.Thread(target=self.expire)
+                    self.expiry.daemon = True
+                    self.expiry.start()
+
+    def expire(self):
+        """ Delete expired sessions every expiry_interval seconds """
+        while True:
+            time.sleep(self.expiry_interval)
+            self.store.expire(self.expiry_batch_size)
+
+
+def new_session_id():
+    """ Return a random, unguessable session id """
+    return binascii.hexlify(os.urandom(24))
+
+
+def make_session_interface(config):
+    """ Create the session interface described by the SESSION_* settings:
+    SESSION_TYPE is 'memory', 'sqlite', 'tiered' or the dotted path of a
+    store class, which is created with the config """
+    session_type = config['SESSION_TYPE']
+    memory = sqlite = None
+    if session_type in ('memory', 'tiered'):
+        memory = MemoryStore(config['SESSION_MEMORY_SIZE'])
+    if session_type in ('sqlite', 'tiered'):
+        sqlite = SQLiteStore(make_engine(config,
+                                         config['SESSION_DATABASE_URI']))
+    if session_type == 'tiered':
+        store = TieredStore(memory, sqlite, config['SESSION_MEMORY_TIMEOUT'])
+    elif session_type in ('memory', 'sqlite'):
+        store = memory or sqlite
+    else:
+        store = import_string(session_type)(config)
+    return ServerSessionInterface(store, config['SESSION_EXPIRY_INTERVAL'],
+                                  config['SESSION_EXPIRY_BATCH_SIZE'],
+                                  [sqlite.engine] if sqlite else [])
@@ -0,0 +1,99 @@
+"""
+    Content addressed storage for uploaded files.
+
+    Files are named by the SHA-256 of their content and sharded into
+    two levels of directories, e.g. 3f/a2/3fa2...c9.png. Identical uploads
+    share one file, and a stored file never changes, so it can be cached
+    by clients indefinitely.
+"""
+
+from werkzeug import secure_filename
+import errno
+import hashlib
+import os
+import re
+import tempfile
+
+
+# extensions of the images items may be uploaded with
+IMAGE_EXTENSIONS = ('jpeg', 'jpg', 'png', 'gif', 'bmp')
+
+STORED_NAME = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.|$)')
+
+# mode of stored files, that of a file created under the process umask, so
+# a front end server running as another user can send them. The umask is
+# read once, at import, since reading it means setting it.
+UMASK = os.umask(0)
+os.umask(UMASK)
+FILE_MODE = 0o666 & ~UMASK
+
+
+class UploadStorage(object):
+    """ Stores uploaded files under the hash of their content """
+
+    def __init__(self, folder, chunk_size):
+        self.folder = folder
+        self.chunk_size = chunk_size
+
+    def save(self, stream, filename):
+        """ Store the content of stream, returning its stored file name.
+
+        The content is hashed while it is copied to a temporary file in
+        chunks, then moved into place unless an identical file exists.
+        filename only provides the extension.
+        """
+        extension = os.path.splitext(secure_filename(filename))[1].lower()
+        digest = hashlib.sha256()
+        handle, temp_path = tempfile.mkstemp(dir=self.folder)
+        try:
+            with os.fdopen(handle, 'wb') as temp:
+                # temporary files are created readable by their owner only
+                os.fchmod(temp.fileno(), FILE_MODE)
+                while True:
+                    chunk = stream.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    temp.write(chunk)
+
+            digest = digest.hexdigest()
+            name = '%s/%s/%s%s' % (digest[:2], digest[2:4], digest,
+                                   extension)
+            path = os.path.join(self.folder, name)
+            if renew(path):
+                # same content is already stored
+                os.remove(temp_path)
+            else:
+                makedirs(os.path.dirname(path))
+                os.rename(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+    def is_immutable(self, filename):
+        """ True if filename names a content addressed file or variant """
+        return STORED_NAME.match(filename) is not None
+
+
+def renew(path):
+    """ Set the modification time of the file at path to now, so the
+    upload sweeper leaves it alone for its minimum age. Returns False if
+    there is no such file. """
+    try:
+        os.utime(path, None)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+    return True
+
+
+def makedirs(path):
+    """ Create a directory and its parents if they do not exist """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,298 @@
+"""
+    Background removal of uploaded files no item refers to.
+
+    Deleting or editing items leaves their images behind, and since
+    identical uploads share one stored file it cannot be removed on the
+    spot. The sweeper walks the upload folder a directory at a time and
+    looks the files of each batch up in the item table, by an index range
+    scan over the names sharing the stem of each file, so memory and the
+    rows read stay bounded by the batch however many uploads there are.
+    Only image files are swept, not placeholders or temporary uploads.
+
+    An orphaned file is moved to the quarantine folder first, and deleted
+    only after the grace period. A quarantined file that an item refers to
+    again in the meantime is put back. Files younger than the minimum age
+    are left alone, so an upload whose item is not committed yet is safe.
+    Storing an upload identical to an existing file renews that file's
+    age, and each file is looked up once more right before it is moved.
+"""
+
+from catalog.instrumentation import counter
+from catalog.models import Item
+from catalog.serving import ENCODINGS
+from catalog.storage import makedirs
+from collections import defaultdict
+from sqlalchemy import select, and_, or_
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+# quarantine file whose lock lets one process sweep at a time, and whose
+# modification time is when the last sweep finished
+LOCK_FILE = '.sweep.lock'
+
+# upper bound of the characters of stored file names, see storage.py
+NAME_END = '~'
+
+# stems looked up per query, within SQLite's limit of bound parameters
+STEMS_PER_QUERY = 400
+
+
+class UploadSweeper(object):
+    """ Quarantines orphaned uploads and deletes them after a grace
+    period, in a background thread every interval seconds """
+
+    def __init__(self, engine, folder, quarantine, min_age, grace, interval,
+                 batch_size, extensions, dry_run=False):
+        self.engine = engine
+        self.folder = os.path.abspath(folder)
+        self.quarantine = os.path.abspath(quarantine)
+        self.min_age = min_age
+        self.grace = grace
+        self.interval = interval
+        self.batch_size = batch_size
+        self.extensions = extensions
+        self.dry_run = dry_run
+        self.thread = None
+        self.lock = threading.Lock()
+        self.totals = defaultdict(int)
+        self.last_sweep = None
+
+    def start(self):
+        """ Start the sweeper thread, in the process serving requests """
+        if self.thread is None and self.interval:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run)
+                    self.thread.daemon = True
+                    self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sweep(wait=False)
+            except Exception:
+                log.exception('Upload sweep failed')
+
+    def sweep(self, dry_run=None, report=None, wait=True):
+        """ Quarantine orphaned uploads and delete the expired quarantined
+        files. With dry_run nothing is moved or deleted.
+
+        report, if given, is called with the action, file name and size of
+        every file acted on. Returns the counts of the sweep, or None when
+        another process is sweeping and wait is false, or when the last
+        sweep finished less than interval seconds ago.
+        """
+        dry_run = self.dry_run if dry_run is None else dry_run
+        makedirs(self.quarantine)
+        lock_path = os.path.join(self.quarantine, LOCK_FILE)
+        swept = os.path.exists(lock_path)
+        with open(lock_path, 'a') as lock:
+            if not swept:
+                # a new lock file does not stand for a sweep
+                os.utime(lock_path, (0, 0))
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if wait else
+                                                   fcntl.LOCK_NB))
+            except IOError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return None
+                raise
+            # every worker runs a sweeper, the first one due does the work
+            if not wait and \
+                    time.time() - os.path.getmtime(lock_path) < self.interval:
+                return None
+
+            started = time.time()
+            counts = defaultdict(int)
+            self.sweep_uploads(started, dry_run, counts, report)
+            self.sweep_quarantine(started, dry_run, counts, report)
+            if not dry_run:
+                os.utime(lock_path, None)
+                with self.lock:
+                    for key, value in counts.items():
+                        self.totals[key] += value
+                    self.last_sweep = time.time()
+            log.info('Upload sweep%s: %s', ' (dry run)' if dry_run else '',
+                     ', '.join('%s %d' % pair
+                               for pair in sorted(counts.items())))
+            return counts
+
+    def sweep_uploads(self, now, dry_run, counts, report):
+        """ Move the orphaned uploads older than min_age to quarantine """
+        for directory, names in self.batches(self.folder):
+            referenced = self.referenced(directory, names)
+            for name in names:
+                counts['scanned'] += 1
+                path = os.path.join(self.folder, directory, name)
+                stat = file_stat(path)
+                if stat is None or self.is_referenced(name, referenced) or \
+                        now - stat.st_mtime < self.min_age:
+                    continue
+                if not dry_run and self.taken_again(directory, name, now):
+                    continue
+                if report is not None:
+                    report('quarantine', os.path.join(directory, name),
+                           stat.st_size)
+                counts['quarantined'] += 1
+                counts['quarantined_bytes'] += stat.st_size
+                if not dry_run:
+                    target = os.path.join(self.quarantine, directory, name)
+                    makedirs(os.path.dirname(target))
+                    shutil.move(path, target)
+                    # the grace period starts now
+                    os.utime(target, None)
+
+    def sweep_quarantine(self, now, dry_run, counts, report):
+        """ Put back quarantined files that are referenced again, and
+        delete those kept longer than the grace period """
+        for directory, names in self.batches(self.quarantine):
+            referenced = self.referenced(directory, names)
+            for name in names:
+                path = os.path.join(self.quarantine, directory, name)
+                stat = file_stat(path)
+                if stat is None:
+                    continue
+                if self.is_referenced(name, referenced):
+                    action = 'restore'
+                    counts['restored'] += 1
+                elif now - stat.st_mtime >= self.grace:
+                    action = 'delete'
+                    counts['deleted'] += 1
+                    counts['reclaimed_bytes'] += stat.st_size
+                else:
+                    continue
+                if report is not None:
+                    report(action, os.path.join(directory, name),
+                           stat.st_size)
+                if dry_run:
+                    continue
+                target = os.path.join(self.folder, directory, name)
+                if action == 'restore' and not os.path.exists(target):
+                    makedirs(os.path.dirname(target))
+                    shutil.move(path, target)
+                else:
+                    # a restored file may have been uploaded again
+                    os.remove(path)
+        if not dry_run:
+            for path, dirs, files in os.walk(self.quarantine, topdown=False):
+                if path != self.quarantine:
+                    remove_empty(path)
+
+    def batches(self, root):
+        """ Yield the (directory, file names) of root's files, directory
+        relative to root, at most batch_size names at a time """
+        for path, dirs, files in os.walk(root):
+            # skip the quarantine, when it is inside the upload folder
+            dirs[:] = sorted(name for name in dirs
+                             if os.path.join(path, name) != self.quarantine)
+            directory = os.path.relpath(path, root)
+            if directory == '.':
+                directory = ''
+            files = sorted(name for name in files if self.is_upload(name))
+            for start in range(0, len(files), self.batch_size):
+                yield directory, files[start:start + self.batch_size]
+
+    def taken_again(self, directory, name, now):
+        """ True if the file was uploaded again or referenced since the
+        batch was looked up, just before it would be quarantined """
+        stat = file_stat(os.path.join(self.folder, directory, name))
+        return stat is None or now - stat.st_mtime < self.min_age or \
+            self.is_referenced(name, self.referenced(directory, [name]))
+
+    def referenced(self, directory, names):
+        """ Return the file names of directory, among those sharing a stem
+        with names, that items refer to as image or image variant """
+        stems = sorted(set(join(directory, name.split('.', 1)[0])
+                           for name in names))
+        item = Item.__table__
+        referenced = set()
+        for start in range(0, len(stems), STEMS_PER_QUERY):
+            # the images named stem or stem.<extension>
+            rows = self.engine.execute(
+                select([item.c.image, item.c.image_variants])
+                .where(or_(*[and_(item.c.image >= stem,
+                                  item.c.image < stem + '.' + NAME_END)
+                             for stem in stems[start:start +
+                                               STEMS_PER_QUERY]])))
+            for image, variants in rows:
+                for filename in [image] + (variants or '').split(','):
+                    if filename and os.path.dirname(filename) == directory:
+                        referenced.add(os.path.basename(filename))
+        return referenced
+
+    def is_upload(self, name):
+        """ True if name is an image, an image variant or a precompressed
+        copy of one """
+        if name.startswith('.'):
+            return False
+        for encoding, suffix in ENCODINGS:
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        extension = os.path.splitext(name)[1][1:].lower()
+        return extension in self.extensions
+
+    def is_referenced(self, name, referenced):
+        """ True if name or the file it is a precompressed copy of is
+        referenced """
+        if name in referenced:
+            return True
+        for encoding, suffix in ENCODINGS:
+            if name.endswith(suffix) and name[:-len(suffix)] in referenced:
+                return True
+        return False
+
+    def metrics(self):
+        """ Return the sweeper's totals in Prometheus text format """
+        with self.lock:
+            files = dict((action, self.totals[action]) for action in
+                         ('scanned', 'quarantined', 'restored', 'deleted'))
+            sizes = {'quarantined': self.totals['quarantined_bytes'],
+                     'reclaimed': self.totals['reclaimed_bytes']}
+            last_sweep = self.last_sweep
+        lines = counter('catalog_upload_sweep_files_total',
+                        'Upload files handled by the sweeper.',
+                        ('action',), files)
+        lines.extend(counter('catalog_upload_sweep_bytes_total',
+                             'Bytes of uploads quarantined and reclaimed.',
+                             ('action',), sizes))
+        if last_sweep is not None:
+            lines.append('# HELP catalog_upload_sweep_last_seconds '
+                         'Time the last upload sweep of this process ended.')
+            lines.append('# TYPE catalog_upload_sweep_last_seconds gauge')
+            lines.append('catalog_upload_sweep_last_seconds %.3f'
+                         % last_sweep)
+        return '\n'.join(lines) + '\n'
+
+
+def join(directory, name):
+    """ Return the stored file name of name in directory """
+    return '%s/%s' % (directory, name) if directory else name
+
+
+def file_stat(path):
+    """ Return the stat of the file at path, or None if it is gone, like
+    a temporary upload file moved into place """
+    try:
+        return os.stat(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+
+
+def remove_empty(path):
+    """ Remove the directory path if it is empty """
+    try:
+        os.rmdir(path)
+    except OSError as e:
+        if e.errno not in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+            raise
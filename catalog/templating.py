@@ -0,0 +1,31 @@
+"""
+    Jinja template compilation and the on-disk bytecode cache.
+
+    Compiled templates are kept in a folder shared by every worker
+    process, so a template is compiled once per deployment rather than
+    once per worker start.
+"""
+
+from jinja2 import FileSystemBytecodeCache
+import os
+import tempfile
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """ Bytecode cache whose files are replaced atomically, so workers
+    never read a file another worker is still writing """
+
+    def dump_bytecode(self, bucket):
+        fd, path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            bucket.write_bytecode(f)
+        os.rename(path, self._get_cache_filename(bucket))
+
+
+def compile_templates(env):
+    """ Compile every HTML template of env, filling its bytecode cache.
+    Returns the template names. """
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    return names
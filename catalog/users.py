@@ -0,0 +1,97 @@
+"""
+    User identity lookups for the login flow.
+
+    Maps email addresses to user ids through a small LRU cache, and
+    creates missing users with a single atomic upsert.
+
+    The cache belongs to the process: a user changed or deleted through
+    another worker stays cached here until pushed out of the cache.
+"""
+
+from catalog.models import User
+from collections import OrderedDict
+from sqlalchemy import event, text
+from sqlalchemy.orm.attributes import get_history
+import sqlite3
+import threading
+
+
+# INSERT ... ON CONFLICT DO UPDATE ... RETURNING needs SQLite 3.35
+UPSERT = text(
+    "INSERT INTO user (name, email, picture) "
+    "VALUES (:name, :email, :picture) "
+    "ON CONFLICT (email) DO UPDATE SET email = excluded.email "
+    "RETURNING id")
+HAS_UPSERT = sqlite3.sqlite_version_info >= (3, 35)
+
+
+class LRUCache(object):
+    """ Thread safe mapping keeping the most recently used entries """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None:
+                self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class UserIdentity(object):
+    """ Resolves login emails to user ids """
+
+    def __init__(self, size):
+        self.ids = LRUCache(size)
+        # cached ids of changed or deleted users are dropped
+        event.listen(User, 'after_update', self._forget)
+        event.listen(User, 'after_delete', self._forget)
+
+    def _forget(self, mapper, connection, user):
+        # after an update the email may already be the new one
+        for email in get_history(user, 'email').sum():
+            self.ids.delete(email)
+
+    def get_id(self, db_session, email):
+        """ Return the id of the user with email, or None """
+        user_id = self.ids.get(email)
+        if user_id is None:
+            user_id = db_session.query(User.id) \
+                .filter_by(email=email).scalar()
+            if user_id is not None:
+                self.ids.set(email, user_id)
+        return user_id
+
+    def get_or_create(self, db_session, name, email, picture):
+        """ Return the id of the user with email, creating the user if
+        there is none """
+        user_id = self.get_id(db_session, email)
+        if user_id is not None:
+            return user_id
+
+        values = {'name': name, 'email': email, 'picture': picture}
+        if HAS_UPSERT:
+            user_id = db_session.execute(UPSERT, values).scalar()
+        else:
+            # a concurrent login may have created the user meanwhile
+            db_session.execute(
+                User.__table__.insert().prefix_with('OR IGNORE'), values)
+            user_id = db_session.query(User.id) \
+                .filter_by(email=email).scalar()
+        db_session.commit()
+        self.ids.set(email, user_id)
+        return user_id
@@ -3,72 +3,233 @@
 """
 
 
-from catalog import app, db_session, csrf
-from catalog.models import Category, Item, User
+from catalog import app, db_session, csrf, cache, images, storage, oauth
+from catalog import users, instrumentation, sweeper
+from catalog.api import item_fields, item_selection, item_columns, item_dict
+from catalog.api import response_format, api_response, cursor_args
+from catalog.cache import CATEGORIES, LATEST_ITEMS
+from catalog.models import User, Category, Item, image_variant
+from catalog.pagination import keyset_page
 from catalog.forms import CategoryForm, ItemForm
+from catalog.search import search_items
+from catalog.serving import send_static, fingerprint
 from datetime import datetime
 from flask import render_template, request, redirect, url_for, jsonify, flash
-from flask import session, abort, send_from_directory, make_response
+from flask import session, abort, make_response
+from flask import Response, stream_with_context
 from flask_wtf.file import FileField
-from oauth2client.client import flow_from_clientsecrets
+from catalog.oauth import GOOGLE_TOKENINFO_URL, GOOGLE_USERINFO_URL
+from catalog.oauth import GOOGLE_REVOKE_URL, FACEBOOK_TOKEN_URL
+from catalog.oauth import FACEBOOK_ME_URL, FACEBOOK_PICTURE_URL
+from catalog.oauth import FACEBOOK_PERMISSIONS_URL
 from oauth2client.client import FlowExchangeError
-from sqlalchemy import exc
-from werkzeug import secure_filename
+from sqlalchemy import exc, func
 from werkzeug.contrib.atom import AtomFeed
-import httplib2
 import json
-import os
 import random
 import requests
 import string
 
 
+def catalogLastModified():
+    """ Get the newest item publication date, when no version is cached """
+    last_modified = db_session.query(func.max(Item.pub_date)).scalar()
+    return (last_modified or datetime.utcnow()).replace(microsecond=0)
+
+
+# cache responses of read-only pages served to anonymous visitors
+cached_response = cache.cached_response(catalogLastModified)
+# API responses are cached per negotiated format
+cached_api_response = cache.cached_response(
+    catalogLastModified, vary=('Accept', response_format))
+
+
 @app.route('/')
 @app.route('/catalog/')
+@cached_response
 def catalog():
-    """ Show catalog home page, with category list and latest items """
-    categories = db_session.query(Category).all()
-    items = db_session.query(Item).order_by(Item.pub_date.desc()).limit(10)
+    """ Show catalog home page, with category list and latest items.
+
+    Older items are paged with the ?after=<cursor> and ?before=<cursor>
+    links of the page.
+    """
+    after, before = cursor_args()
+    if after is None and before is None:
+        page = getLatestItems()
+    else:
+        page = latestItemsPage(after, before)
     return render_template('catalog.html',
-                           categories=categories, latest_items=items)
+                           categories=getCategories(),
+                           latest_items=page.rows,
+                           page=page)
 
 
 @app.route('/catalog/json')
 def catalogJSON():
-    """ Return all catalog items in JSON format """
-    categories = db_session.query(Category).all()
-    return jsonify(categories=[category.serialize for category in categories])
+    """ Return catalog items in JSON format.
+
+    The document is streamed one category at a time. Use ?limit=<n> to
+    page through categories and ?after=<id> with the returned 'next'
+    cursor to fetch the following page, and ?fields=<names> to select
+    item fields.
+    """
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', app.config['JSON_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['JSON_PAGE_SIZE_MAX']))
+    fields = item_fields()
+    selection = item_selection(fields, 'id')
+    # rows are the category's id, name and user_id, then the item fields
+    item_id = 3 + selection.index('id')
+
+    page = db_session.query(Category.id).filter(Category.id > after) \
+        .order_by(Category.id).limit(limit).subquery()
+    rows = db_session.query(Category.id, Category.name, Category.user_id,
+                            *item_columns(selection)) \
+        .outerjoin(Item, Item.category_id == Category.id) \
+        .filter(Category.id.in_(page)) \
+        .order_by(Category.id, Item.id) \
+        .yield_per(app.config['JSON_BATCH_SIZE'])
+
+    def generate():
+        yield '{"categories": ['
+        current = None
+        count = 0
+        for row in rows:
+            if row[0] != current:
+                if current is not None:
+                    yield ']}, '
+                current = row[0]
+                count += 1
+                yield '{"id": %s, "name": %s, "user_id": %s, "items": [' % (
+                    json.dumps(row[0]), json.dumps(row[1]),
+                    json.dumps(row[2]))
+                first = True
+            if row[item_id] is not None:
+                if not first:
+                    yield ', '
+                first = False
+                yield json.dumps(item_dict(row, fields, 3))
+        if current is not None:
+            yield ']}'
+        yield ']'
+        if count == limit:
+            yield ', "next": %d' % current
+        yield '}'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
 
 
 @app.route('/catalog/recent.atom')
+@cached_response
 def catalogRecentAtom():
     """ Return latest items in Atom format """
-    items = db_session.query(Item).order_by(Item.pub_date.desc()).limit(10)
-    feed = AtomFeed('Recent Items', feed_url=request.url, url=request.url_root)
-    for item in items:
-        feed.add(item.name, unicode(item.description),
+    return atomFeed('Recent Items')
+
+
+@app.route('/category/<name>/recent.atom')
+@cached_response
+def categoryRecentAtom(name):
+    """ Return latest items of a category in Atom format """
+    category = db_session.query(Category.id).filter_by(name=name).first()
+
+    if category is None:
+        abort(404)
+
+    return atomFeed('Recent %s Items' % name,
+                    Item.category_id == category.id)
+
+
+def atomFeed(title, *criteria):
+    """ Return an Atom feed of the latest items matching criteria.
+
+    Use ?since=<YYYY-MM-DDTHH:MM:SSZ> to get only the items published
+    after that time. The response's Last-Modified date is the newest
+    item's publication date.
+    """
+    since = request.args.get('since')
+    query = db_session.query(Item.name, Item.description, Item.pub_date,
+                             User.name) \
+        .join(User, Item.user_id == User.id).filter(*criteria)
+    if since is not None:
+        try:
+            since = datetime.strptime(since, '%Y-%m-%dT%H:%M:%SZ')
+        except ValueError:
+            abort(400)
+        query = query.filter(Item.pub_date > since)
+    items = query.order_by(Item.pub_date.desc(), Item.id.desc()) \
+        .limit(app.config['FEED_SIZE']).all()
+
+    feed = AtomFeed(title, url=request.url_root,
+                    feed_url=url_for(request.endpoint, _external=True,
+                                     **request.view_args))
+    for name, description, pub_date, author in items:
+        feed.add(name, description,
                  content_type='html',
-                 author=item.user.name,
-                 url=url_for('item', name=item.name),
-                 updated=item.pub_date,
-                 published=item.pub_date)
-    return feed.get_response()
+                 author=author,
+                 url=url_for('item', name=name),
+                 updated=pub_date,
+                 published=pub_date)
+    response = feed.get_response()
+    if items:
+        response.last_modified = items[0].pub_date
+    return response
 
 
 @app.route('/category/<name>/')
 @app.route('/category/<name>/items')
+@cached_response
 def category(name):
-    """ View a category of items """
-    categories = db_session.query(Category).all()
+    """ View a category of items, a page at a time, newest first """
+    after, before = cursor_args()
+    categories = getCategories()
     category = db_session.query(Category).filter_by(name=name).first()
 
     if category is None:
         abort(404)
 
+    page = keyset_page(
+        db_session.query(Item.name, Item.pub_date, Item.id)
+        .filter(Item.category_id == category.id),
+        Item.pub_date, Item.id, app.config['CATEGORY_PAGE_SIZE'],
+        after, before)
     return render_template('category.html',
                            categories=categories,
                            category=category,
-                           items=category.items)
+                           items=page.rows,
+                           item_count=category.item_count,
+                           page=page)
+
+
+@app.route('/category/<name>/json')
+@cached_api_response
+def categoryJSON(name):
+    """ Return a page of a category's items in JSON format, newest first.
+
+    Use ?limit=<n> to set the page size, and ?after=<cursor> or
+    ?before=<cursor> with the returned 'next' and 'prev' cursors to move
+    between pages. Select item fields with ?fields=<names>.
+    """
+    after, before = cursor_args()
+    limit = request.args.get('limit', app.config['CATEGORY_PAGE_SIZE'],
+                             type=int)
+    limit = max(1, min(limit, app.config['JSON_PAGE_SIZE_MAX']))
+    fields = item_fields()
+    category = db_session.query(Category).filter_by(name=name).first()
+
+    if category is None:
+        abort(404)
+
+    page = keyset_page(
+        db_session.query(*item_columns(
+            item_selection(fields, 'pub_date', 'id')))
+        .filter(Item.category_id == category.id),
+        Item.pub_date, Item.id, limit, after, before)
+    return api_response(id=category.id, name=category.name,
+                        user_id=category.user_id,
+                        count=category.item_count,
+                        items=[item_dict(row, fields) for row in page.rows],
+                        next=page.next, prev=page.prev)
 
 
 @app.route('/category/new/', methods=['GET', 'POST'])
@@ -98,6 +259,7 @@ def newCategory():
             form.name.errors.append("Category already exists.")
             return render_template('new_category.html', form=form)
 
+        invalidateCatalogCache()
         flash("Created new category %s." % category.name)
         return redirect(url_for('catalog'))
     return render_template('new_category.html', form=form)
@@ -131,6 +293,7 @@ def editCategory(name):
             form.name.errors.append("Category already exists.")
             return render_template('edit_category.html',
                                    category=category, form=form)
+        invalidateCatalogCache()
         flash("Category %s edited." % category.name)
         return redirect(url_for('category', name=category.name))
     return render_template('edit_category.html', category=category, form=form)
@@ -157,6 +320,7 @@ def deleteCategory(name):
         # related items should be deleted automatically
         db_session.delete(category)
         db_session.commit()
+        invalidateCatalogCache()
         flash('%s Successfully Deleted' % category.name)
         return redirect(url_for('catalog'))
     else:
@@ -166,21 +330,103 @@ def deleteCategory(name):
 
 
 @app.route('/item/<name>')
+@cached_response
 def item(name):
     """ View an item """
-    item = db_session.query(Item).filter_by(name=name).first()
+    row = db_session.query(Item.name, Item.description, Item.user_id,
+                           Item.image, Item.image_variants,
+                           User.name, User.picture) \
+        .outerjoin(User, Item.user_id == User.id) \
+        .filter(Item.name == name).first()
 
-    if item is None:
+    if row is None:
         abort(404)
 
-    owner = db_session.query(User).filter_by(id=item.user_id).first()
+    (name, description, user_id, image, variants,
+     owner_name, owner_picture) = row
+    item = {'name': name, 'description': description, 'user_id': user_id,
+            'image': image,
+            'image_card': image_variant(image, variants, 'card'),
+            'image_full': image_variant(image, variants, 'full')}
+    owner = None
+    if owner_name is not None:
+        owner = {'name': owner_name, 'picture': owner_picture}
     return render_template('item.html', item=item, owner=owner)
 
 
+@app.route('/item/<name>/json')
+@cached_api_response
+def itemJSON(name):
+    """ Return an item in JSON format, with ?fields=<names> to select
+    its fields """
+    fields = item_fields()
+    row = db_session.query(*item_columns(fields)) \
+        .filter(Item.name == name).first()
+
+    if row is None:
+        abort(404)
+
+    return api_response(**item_dict(row, fields))
+
+
+@app.route('/search')
+@cached_response
+def search():
+    """ Search items by name and description """
+    query, page, results, more = searchResults()
+    return render_template('search.html',
+                           categories=getCategories(),
+                           query=query, page=page,
+                           results=results, more=more)
+
+
+@app.route('/search/json')
+@cached_response
+def searchJSON():
+    """ Return item search results in JSON format """
+    query, page, results, more = searchResults()
+    return jsonify(query=query, page=page,
+                   next=page + 1 if more else None,
+                   items=results)
+
+
+def searchResults():
+    """ Run the search given by the q and page request arguments """
+    query = request.args.get('q', '')
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = app.config['SEARCH_PAGE_SIZE']
+    results, more = search_items(db_session, query, per_page,
+                                 (page - 1) * per_page)
+    return query, page, results, more
+
+
 @app.route('/uploads/<path:filename>')
 def uploads(filename):
     """ Return item image from uploads folder """
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # the URL of a content addressed file changes with its content
+    return send_static(app.config['UPLOAD_FOLDER'], filename,
+                       app.config['STATIC_MAX_AGE'],
+                       immutable=storage.is_immutable(filename))
+
+
+@app.endpoint('static')
+def static(filename):
+    """ Return a file from the static folder """
+    # fingerprinted URLs change with the file's content
+    version = request.args.get('v')
+    immutable = (version is not None and
+                 version == fingerprint(app.static_folder, filename))
+    return send_static(app.static_folder, filename,
+                       app.config['STATIC_MAX_AGE'], immutable=immutable)
+
+
+@app.url_defaults
+def staticFingerprint(endpoint, values):
+    """ Add a content fingerprint to url_for('static', ...) URLs """
+    if endpoint == 'static' and 'filename' in values:
+        version = fingerprint(app.static_folder, values['filename'])
+        if version is not None:
+            values.setdefault('v', version)
 
 
 @app.route('/item/new/', methods=['GET', 'POST'])
@@ -192,8 +438,8 @@ def newItem():
         return redirect('/login')
 
     form = ItemForm()
-    categories = db_session.query(Category.id, Category.name).all()
-    form.category_id.choices = categories
+    form.category_id.choices = [(c['id'], c['name'])
+                                for c in getCategories()]
 
     if form.validate_on_submit():
         # check that name != 'new', which is used for routing
@@ -205,10 +451,9 @@ def newItem():
         filename = None
         # check if user uploaded file and sanitize filename
         if form.image.has_file():
-            # get the filename, ensuring that it is safe
-            filename = secure_filename(form.image.data.filename)
-            form.image.data.save(
-                os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            # store the file under the hash of its content
+            filename = storage.save(form.image.data.stream,
+                                    form.image.data.filename)
         # create new item and commit to database
         item = Item(
             name=form.name.data,
@@ -226,6 +471,10 @@ def newItem():
             db_session.rollback()
             form.name.errors.append("Item already exists.")
             return render_template('new_item.html', form=form)
+        if filename:
+            # resize the image in the background
+            images.submit(item.id, filename)
+        invalidateCatalogCache()
         flash("Created new item %s." % item.name)
         return redirect(url_for('item', name=item.name))
     return render_template('new_item.html', form=form)
@@ -248,17 +497,18 @@ def editItem(name):
         abort(401)
 
     form = ItemForm(obj=item)
-    categories = db_session.query(Category.id, Category.name).all()
-    form.category_id.choices = categories
+    form.category_id.choices = [(c['id'], c['name'])
+                                for c in getCategories()]
 
     if form.validate_on_submit():
         filename = item.image
         # check if user uploaded file and sanitize filename
         if form.image.has_file():
-            # gets the filename, ensuring that it is safe
-            filename = secure_filename(form.image.data.filename)
-            form.image.data.save(
-                os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            # store the file under the hash of its content
+            filename = storage.save(form.image.data.stream,
+                                    form.image.data.filename)
+            # variants of the old image no longer apply
+            item.image_variants = None
 
         form.populate_obj(item)
         item.image = filename
@@ -270,6 +520,10 @@ def editItem(name):
             db_session.rollback()
             form.name.errors.append("Item already exists.")
             return render_template('edit_item.html', item=item, form=form)
+        if form.image.has_file():
+            # resize the new image in the background
+            images.submit(item.id, filename)
+        invalidateCatalogCache()
         flash("Item %s edited." % item.name)
         return redirect(url_for('item', name=item.name))
     return render_template('edit_item.html', item=item, form=form)
@@ -294,6 +548,7 @@ def deleteItem(name):
     if request.method == 'POST':
         db_session.delete(item)
         db_session.commit()
+        invalidateCatalogCache()
         flash('%s Successfully Deleted' % item.name)
         return redirect(url_for('catalog'))
     else:
@@ -301,6 +556,64 @@ def deleteItem(name):
         return render_template('delete_item.html', item=item, form=form)
 
 
+@app.route('/catalog/cache/stats')
+def cacheStats():
+    """ Return catalog cache hit and miss counters in JSON format """
+    return jsonify(cache.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    """ Return request and upload sweeper metrics in Prometheus text
+    format """
+    if not instrumentation.enabled:
+        abort(404)
+    return Response(instrumentation.metrics() + sweeper.metrics(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+# CATALOG CACHE ####################################################
+
+
+def getCategories():
+    """ Get the category list, cached for the sidebar and item forms.
+
+    Category page URLs are built once here rather than on every render.
+    """
+    def load():
+        rows = db_session.query(Category.id, Category.name,
+                                Category.item_count) \
+            .order_by(Category.id)
+        return [{'id': id, 'name': name, 'item_count': item_count,
+                 'url': url_for('category', name=name)}
+                for id, name, item_count in rows]
+    return cache.get_or_load(CATEGORIES, load)
+
+
+def getLatestItems():
+    """ Get the first page of the latest items, cached """
+    return cache.get_or_load(LATEST_ITEMS, latestItemsPage)
+
+
+def latestItemsPage(after=None, before=None):
+    """ Get a page of the latest items with their category names """
+    rows = db_session.query(Item.name, Category.name, Item.pub_date,
+                            Item.id) \
+        .join(Category, Item.category_id == Category.id)
+    page = keyset_page(rows, Item.pub_date, Item.id,
+                       app.config['LATEST_ITEMS_PAGE_SIZE'], after, before,
+                       key=lambda row: row[2:])
+    return page._replace(rows=[
+        {'name': name, 'category_name': category_name}
+        for name, category_name, pub_date, id in page.rows])
+
+
+def invalidateCatalogCache():
+    """ Drop cached catalog data and pages after a write is committed """
+    cache.delete(CATEGORIES, LATEST_ITEMS)
+    cache.touch()
+
+
 # AUTHENTICATION ###################################################
 
 
@@ -332,6 +645,7 @@ def logout():
         del session['picture']
         del session['user_id']
         del session['provider']
+        app.session_interface.regenerate(session)
         flash("You have successfully been logged out.")
         return redirect(url_for('catalog'))
     else:
@@ -351,29 +665,29 @@ def gconnect():
     # Obtain authorization code
     code = request.data
 
-    secrets_file_path = os.path.join(app.config['APP_ROOT'],'google_client_secrets.json')
-
     try:
         # Upgrade the authorization code into a credentials object
-        oauth_flow = flow_from_clientsecrets(secrets_file_path, scope='')
-        oauth_flow.redirect_uri = 'postmessage'
-        credentials = oauth_flow.step2_exchange(code)
+        credentials = oauth.exchange_google_code(code)
     except FlowExchangeError:
         response = make_response(
             json.dumps('Failed to upgrade the authorization code.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
 
-    # Check that the access token is valid.
+    # Check that the access token is valid, and get user info
     access_token = credentials.access_token
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-           % access_token)
-    h = httplib2.Http()
-    result = json.loads(h.request(url, 'GET')[1])
+    try:
+        result, data = oauth.get_all_json(
+            (GOOGLE_TOKENINFO_URL, {'access_token': access_token}),
+            (GOOGLE_USERINFO_URL, {'access_token': access_token,
+                                   'alt': 'json'}))
+    except requests.RequestException:
+        return providerError()
     # If there was an error in the access token info, abort.
     if result.get('error') is not None:
         response = make_response(json.dumps(result.get('error')), 500)
         response.headers['Content-Type'] = 'application/json'
+        return response
 
     # Verify that the access token is used for the intended user.
     gplus_id = credentials.id_token['sub']
@@ -384,9 +698,7 @@ def gconnect():
         return response
 
     # Verify that the access token is valid for this app.
-    client_id = json.loads(
-        open(secrets_file_path, 'r').read())['web']['client_id']
-    if result['issued_to'] != client_id:
+    if result['issued_to'] != oauth.google['client_id']:
         response = make_response(
             json.dumps("Token's client ID does not match app's."), 401)
         response.headers['Content-Type'] = 'application/json'
@@ -400,26 +712,19 @@ def gconnect():
         response.headers['Content-Type'] = 'application/json'
         return response
 
+    app.session_interface.regenerate(session)
     # Store the access token in the session for later use.
     session['access_token'] = credentials.access_token
     session['gplus_id'] = gplus_id
 
-    # Get user info
-    userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {'access_token': credentials.access_token, 'alt': 'json'}
-    answer = requests.get(userinfo_url, params=params)
-
-    data = answer.json()
     session['username'] = data['name']
     session['picture'] = data['picture']
     session['email'] = data['email']
     session['provider'] = 'google'
 
-    user_id = getUserID(session['email'])
-    if not user_id:
-        # Create new user
-        user_id = createUser(session)
-    session['user_id'] = user_id
+    # get the user, creating a new one on first login
+    session['user_id'] = users.get_or_create(
+        db_session, session['username'], session['email'], session['picture'])
 
     output = ''
     output += '<h3>Welcome, '
@@ -438,13 +743,14 @@ def gdisconnect():
     if 'access_token' not in session:
         response = make_response(
             json.dumps('Current user not connected.'), 401)
-    	response.headers['Content-Type'] = 'application/json'
+        response.headers['Content-Type'] = 'application/json'
         return response
-    url = ('https://accounts.google.com/o/oauth2/revoke?token=%s'
-           % session['access_token'])
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[0]
-    if result['status'] != '200':
+    try:
+        result = oauth.request('GET', GOOGLE_REVOKE_URL,
+                               {'token': session['access_token']})
+    except requests.RequestException:
+        return providerError()
+    if result.status_code != 200:
         response = make_response(json.dumps('Failed to revoke token for given'
                                             ' user.', 400))
         response.headers['Content-Type'] = 'application/json'
@@ -461,51 +767,40 @@ def fbconnect():
         return response
     access_token = request.data
 
-    secrets_file_path = os.path.join(app.config['APP_ROOT'],'fb_client_secrets.json')
-    app_id = json.loads(open(secrets_file_path, 'r').read())[
-        'web']['app_id']
-    app_secret = json.loads(
-        open(secrets_file_path, 'r').read())['web']['app_secret']
-    url = ('https://graph.facebook.com/oauth/access_token?'
-           'grant_type=fb_exchange_token&client_id=%s&client_secret=%s'
-           '&fb_exchange_token=%s' % (app_id, app_secret, access_token))
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[1]
-
-    # Use token to get user info from API
-    userinfo_url = "https://graph.facebook.com/v2.5/me"
-    # strip expire tag from access token
-    token = result.split("&")[0]
-
-    url = 'https://graph.facebook.com/v2.5/me?%s&fields=name,id,email' % token
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[1]
-    data = json.loads(result)
+    try:
+        result = oauth.request('GET', FACEBOOK_TOKEN_URL, {
+            'grant_type': 'fb_exchange_token',
+            'client_id': oauth.facebook['app_id'],
+            'client_secret': oauth.facebook['app_secret'],
+            'fb_exchange_token': access_token}).text
+
+        # strip expire tag from access token
+        token = result.split("&")[0]
+        # The token must be stored in the login_session in order to
+        # properly logout, strip out the information before the equals sign
+        stored_token = token.split("=")[1]
+
+        # Get user info and picture from API
+        data, picture = oauth.get_all_json(
+            (FACEBOOK_ME_URL, {'access_token': stored_token,
+                               'fields': 'name,id,email'}),
+            (FACEBOOK_PICTURE_URL, {'access_token': stored_token,
+                                    'redirect': 0,
+                                    'height': 200, 'width': 200}))
+    except requests.RequestException:
+        return providerError()
+
+    app.session_interface.regenerate(session)
     session['provider'] = 'facebook'
     session['username'] = data["name"]
     session['email'] = data["email"]
     session['facebook_id'] = data["id"]
-
-    # The token must be stored in the login_session in order to properly logout
-    # let's strip out the information before the equals sign in our token
-    stored_token = token.split("=")[1]
     session['access_token'] = stored_token
+    session['picture'] = picture["data"]["url"]
 
-    # Get user picture
-    url = ('https://graph.facebook.com/v2.5/me/picture?%s'
-           '&redirect=0&height=200&width=200' % token)
-    h = httplib2.Http()
-    result = h.request(url, 'GET')[1]
-    data = json.loads(result)
-
-    session['picture'] = data["data"]["url"]
-
-    # see if user exists
-    user_id = getUserID(session['email'])
-    if not user_id:
-        # Create new user
-        user_id = createUser(session)
-    session['user_id'] = user_id
+    # get the user, creating a new one on first login
+    session['user_id'] = users.get_or_create(
+        db_session, session['username'], session['email'], session['picture'])
 
     output = ''
     output += '<h3>Welcome, '
@@ -524,27 +819,17 @@ def fbdisconnect():
     facebook_id = session['facebook_id']
     # The access token must me included to successfully logout
     access_token = session['access_token']
-    url = ('https://graph.facebook.com/%s/permissions?access_token=%s'
-           % (facebook_id, access_token))
-    h = httplib2.Http()
-    result = h.request(url, 'DELETE')[1]
+    try:
+        oauth.request('DELETE', FACEBOOK_PERMISSIONS_URL % facebook_id,
+                      {'access_token': access_token})
+    except requests.RequestException:
+        return providerError()
     return "you have been logged out"
 
 
-def createUser(session):
-    """ Create new user record """
-    newUser = User(name=session['username'], email=session[
-                   'email'], picture=session['picture'])
-    db_session.add(newUser)
-    db_session.commit()
-    user = db_session.query(User).filter_by(email=session['email']).one()
-    return user.id
-
-
-def getUserID(email):
-    """ Get user by email address """
-    try:
-        user = db_session.query(User).filter_by(email=email).one()
-        return user.id
-    except:
-        return None
+def providerError():
+    """ Response for a login provider that failed or timed out """
+    response = make_response(
+        json.dumps('Login provider did not respond.'), 504)
+    response.headers['Content-Type'] = 'application/json'
+    return response
@@ -10,5 +10,123 @@ DATABASE_URI = 'sqlite:///catalog.db'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 SECRET_KEY = 'a secret'
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+# Compiled template cache folder, None to compile templates in memory
+TEMPLATE_CACHE_FOLDER = os.path.join(APP_ROOT, 'template_cache')
 # Image upload folder
 UPLOAD_FOLDER = os.path.join(APP_ROOT, 'catalog/static/uploads')
+# JSON endpoint paging: categories per page and rows fetched per batch
+JSON_PAGE_SIZE = 50
+JSON_PAGE_SIZE_MAX = 500
+JSON_BATCH_SIZE = 1000
+# Database connection pool
+DATABASE_POOL_SIZE = 5
+DATABASE_MAX_OVERFLOW = 10
+DATABASE_POOL_RECYCLE = 3600
+DATABASE_POOL_PRE_PING = True
+# Read replicas: GET requests read from one of DATABASE_REPLICA_URIS,
+# picked 'round-robin' or by 'least-latency'. A user who wrote reads from
+# the primary for READ_YOUR_WRITES_SECONDS. Replica connections are
+# recycled every DATABASE_REPLICA_RECYCLE seconds to see refreshed copies
+DATABASE_REPLICA_URIS = []
+DATABASE_REPLICA_SELECTION = 'round-robin'
+DATABASE_REPLICA_RECYCLE = 60
+READ_YOUR_WRITES_SECONDS = 10
+# SQLite connection pragmas, busy timeout in milliseconds
+SQLITE_JOURNAL_MODE = 'WAL'
+SQLITE_BUSY_TIMEOUT = 5000
+# Server-side sessions: SESSION_TYPE is 'memory', 'sqlite', 'tiered' (memory
+# in front of sqlite) or a dotted store class path. Memory tier entries are
+# trusted for SESSION_MEMORY_TIMEOUT seconds, so with several workers
+# 'tiered' can serve a session another worker has since changed; use it
+# with a single worker only. Expired sessions are deleted every
+# SESSION_EXPIRY_INTERVAL seconds, in batches
+SESSION_TYPE = 'sqlite'
+SESSION_DATABASE_URI = 'sqlite:///sessions.db'
+SESSION_MEMORY_SIZE = 10000
+SESSION_MEMORY_TIMEOUT = 30
+SESSION_EXPIRY_INTERVAL = 600
+SESSION_EXPIRY_BATCH_SIZE = 1000
+# Catalog cache: 'simple', 'redis', 'null' or a dotted BaseCache class path.
+# The catalog version (Last-Modified date and page generation) is reloaded
+# after CACHE_VERSION_TIMEOUT seconds, at most CACHE_DEFAULT_TIMEOUT, so a
+# worker that did not see a write stops serving it within that time
+CACHE_TYPE = 'simple'
+CACHE_OPTIONS = {}
+CACHE_DEFAULT_TIMEOUT = 300
+CACHE_VERSION_TIMEOUT = 300
+# Items per page of the home page and of category pages
+LATEST_ITEMS_PAGE_SIZE = 10
+CATEGORY_PAGE_SIZE = 50
+# Entries in Atom feeds
+FEED_SIZE = 10
+# Item search results per page
+SEARCH_PAGE_SIZE = 20
+# Image variants generated for uploads: (name, maximum width and height)
+IMAGE_VARIANTS = (('thumb', 80), ('card', 250), ('full', 1200))
+IMAGE_FORMAT = 'WEBP'
+IMAGE_QUALITY = 80
+IMAGE_WORKERS = 2
+# Dynamic responses of at least COMPRESS_MIN_SIZE bytes are compressed,
+# at a gzip level (0-9) also used as brotli quality
+COMPRESS_MIN_SIZE = 500
+COMPRESS_LEVEL = 6
+# Uploads are copied to storage in chunks of this many bytes
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Uploads no item refers to and older than UPLOAD_SWEEP_MIN_AGE seconds
+# are moved to UPLOAD_QUARANTINE_FOLDER, and deleted after staying there
+# UPLOAD_SWEEP_GRACE seconds. The sweep runs in the background every
+# UPLOAD_SWEEP_INTERVAL seconds (0 for never), looking up
+# UPLOAD_SWEEP_BATCH_SIZE files per query. With UPLOAD_SWEEP_DRY_RUN it
+# only logs what it would do
+UPLOAD_QUARANTINE_FOLDER = os.path.join(APP_ROOT, 'upload_quarantine')
+UPLOAD_SWEEP_MIN_AGE = 3600
+UPLOAD_SWEEP_GRACE = 7 * 24 * 3600
+UPLOAD_SWEEP_INTERVAL = 3600
+UPLOAD_SWEEP_BATCH_SIZE = 500
+UPLOAD_SWEEP_DRY_RUN = False
+# Static file and upload caching, in seconds
+STATIC_MAX_AGE = 12 * 3600
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Serve files through the front proxy: set USE_X_SENDFILE = True for
+# X-Sendfile, or map folders to nginx internal locations for
+# X-Accel-Redirect, e.g. {UPLOAD_FOLDER: '/protected/uploads/'}
+USE_X_SENDFILE = False
+X_ACCEL_REDIRECT_LOCATIONS = {}
+# OAuth providers: client secrets, (connect, read) timeouts in seconds,
+# pooled connections, and threads for concurrent provider calls.
+# OAUTH_STUB answers logins with a canned user, without the network.
+GOOGLE_CLIENT_SECRETS = os.path.join(APP_ROOT, 'google_client_secrets.json')
+FACEBOOK_CLIENT_SECRETS = os.path.join(APP_ROOT, 'fb_client_secrets.json')
+OAUTH_TIMEOUT = (3.05, 10)
+OAUTH_POOL_SIZE = 10
+OAUTH_WORKERS = 4
+OAUTH_STUB = False
+# Number of login email to user id mappings kept in memory
+USER_CACHE_SIZE = 10000
+# Production server (python serve.py): address, worker processes, threads
+# per worker, seconds before a silent worker is restarted or a stopping
+# worker is killed, and requests a worker serves before it is replaced
+# (0 for never)
+SERVER_BIND = '0.0.0.0:8000'
+SERVER_WORKERS = 4
+SERVER_THREADS = 2
+SERVER_TIMEOUT = 30
+SERVER_GRACEFUL_TIMEOUT = 30
+SERVER_MAX_REQUESTS = 0
+# Read-only API mounted at READ_API_PREFIX. Its own server (python
+# serve_reads.py) needs gevent: it holds up to READ_API_MAX_CONNECTIONS
+# client connections and runs queries in READ_API_THREADS threads
+READ_API_PREFIX = '/api'
+READ_API_BIND = '0.0.0.0:8001'
+READ_API_MAX_CONNECTIONS = 10000
+READ_API_THREADS = 10
+# Request instrumentation: timings, slow query log and /metrics.
+# Statements slower than SLOW_QUERY_THRESHOLD seconds are logged, and with
+# PROFILE_THRESHOLD set, requests slower than that many seconds have their
+# sampled stacks written to PROFILE_FOLDER
+INSTRUMENTATION = False
+SLOW_QUERY_THRESHOLD = 0.1
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROFILE_THRESHOLD = None
+PROFILE_INTERVAL = 0.005
+PROFILE_FOLDER = os.path.join(APP_ROOT, 'profiles')
@@ -5,6 +5,7 @@
 
 from config import *
 from catalog.models import Base
+from catalog import migrations, search
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -26,6 +27,11 @@ def clearDb():
     """ Drop and create tables """
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
+    # create_all does not know the search index; with it in place
+    # the new database is at the latest schema version
+    with engine.connect() as connection:
+        search.create_index(connection)
+        migrations.stamp(connection, migrations.latest_version())
 
 
 if __name__ == '__main__':
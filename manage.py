@@ -0,0 +1,186 @@
+"""
+    Catalog management commands.
+    Run python manage.py --help for the list of commands.
+"""
+
+from catalog import app, engine, migrations, images, sweeper
+from catalog.serving import precompress
+from catalog.templating import compile_templates
+from catalog.models import Item, reconcile_item_counts
+from catalog.routing import sync_replicas
+from catalog.bulk import import_items, export_items
+from catalog.views import invalidateCatalogCache
+import argparse
+import sys
+
+
+def upgrade(args):
+    """ Upgrade the database schema to the latest version """
+    applied = migrations.upgrade(engine)
+    for version, name in applied:
+        print('Applied migration %d: %s' % (version, name))
+    if not applied:
+        print('Database is up to date.')
+
+
+def version(args):
+    """ Show the database schema version """
+    with engine.connect() as connection:
+        print('Schema version %d of %d' % (
+            migrations.current_version(connection),
+            migrations.latest_version()))
+
+
+def process_images(args):
+    """ Generate image variants for items that have none yet """
+    item = Item.__table__
+    rows = engine.execute(
+        item.select().where(item.c.image.isnot(None))
+        .where(item.c.image_variants.is_(None))).fetchall()
+    for row in rows:
+        images.process(row.id, row.image)
+    print('Processed %d images.' % len(rows))
+
+
+def reconcile_counts(args):
+    """ Recompute the item count of every category """
+    with engine.connect() as connection:
+        reconcile_item_counts(connection)
+    invalidateCatalogCache()
+    print('Item counts reconciled.')
+
+
+def precompress_static(args):
+    """ Write precompressed copies of static files """
+    for path in precompress(app.static_folder):
+        print(path)
+
+
+def compile_all_templates(args):
+    """ Compile the templates into the template bytecode cache """
+    for name in compile_templates(app.jinja_env):
+        print(name)
+
+
+def expire_sessions(args):
+    """ Delete expired server-side sessions """
+    count = app.session_interface.store.expire(
+        app.config['SESSION_EXPIRY_BATCH_SIZE'])
+    print('Deleted %d expired sessions.' % count)
+
+
+def sync_replica_files(args):
+    """ Refresh the SQLite read replicas with copies of the database """
+    for path in sync_replicas(app.config):
+        print(path)
+
+
+def sweep_uploads(args):
+    """ Quarantine uploads no item refers to, delete expired ones """
+    def report(action, name, size):
+        print('%s %s (%d bytes)' % (action, name, size))
+
+    counts = sweeper.sweep(dry_run=args.dry_run or None, report=report)
+    print('%sScanned %d files, quarantined %d (%d bytes), restored %d, '
+          'deleted %d (%d bytes reclaimed).' % (
+              'Dry run. ' if args.dry_run else '', counts['scanned'],
+              counts['quarantined'], counts['quarantined_bytes'],
+              counts['restored'], counts['deleted'],
+              counts['reclaimed_bytes']))
+
+
+def file_format(args):
+    """ Format of the import or export file, from --format or its name """
+    if args.format:
+        return args.format
+    return 'csv' if args.file.endswith('.csv') else 'jsonl'
+
+
+def import_file(args):
+    """ Import items from a CSV or JSON Lines file """
+    def progress(count, elapsed):
+        sys.stderr.write('\r%d records, %.0f records/s' % (
+            count, count / max(elapsed, 0.001)))
+
+    with open(args.file, 'rb') as f:
+        count, inserted = import_items(engine, f, file_format(args),
+                                       args.email, args.batch_size,
+                                       args.skip_existing,
+                                       args.defer_search_index, progress)
+    sys.stderr.write('\n')
+    invalidateCatalogCache()
+    print('Imported %d of %d items.' % (inserted, count))
+
+
+def export_file(args):
+    """ Export all items to a CSV or JSON Lines file """
+    if args.file == '-':
+        count = export_items(engine, sys.stdout, file_format(args))
+    else:
+        with open(args.file, 'wb') as f:
+            count = export_items(engine, f, file_format(args))
+    sys.stderr.write('Exported %d items.\n' % count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the catalog app.')
+    commands = parser.add_subparsers(title='commands')
+
+    command = commands.add_parser('upgrade', help=upgrade.__doc__)
+    command.set_defaults(func=upgrade)
+
+    command = commands.add_parser('version', help=version.__doc__)
+    command.set_defaults(func=version)
+
+    command = commands.add_parser('process-images',
+                                  help=process_images.__doc__)
+    command.set_defaults(func=process_images)
+
+    command = commands.add_parser('reconcile-counts',
+                                  help=reconcile_counts.__doc__)
+    command.set_defaults(func=reconcile_counts)
+
+    command = commands.add_parser('precompress',
+                                  help=precompress_static.__doc__)
+    command.set_defaults(func=precompress_static)
+
+    command = commands.add_parser('compile-templates',
+                                  help=compile_all_templates.__doc__)
+    command.set_defaults(func=compile_all_templates)
+
+    command = commands.add_parser('expire-sessions',
+                                  help=expire_sessions.__doc__)
+    command.set_defaults(func=expire_sessions)
+
+    command = commands.add_parser('sync-replicas',
+                                  help=sync_replica_files.__doc__)
+    command.set_defaults(func=sync_replica_files)
+
+    command = commands.add_parser('sweep-uploads', help=sweep_uploads.__doc__)
+    command.add_argument('--dry-run', action='store_true',
+                         help='only list what would be done')
+    command.set_defaults(func=sweep_uploads)
+
+    command = commands.add_parser('import', help=import_file.__doc__)
+    command.add_argument('file')
+    command.add_argument('--format', choices=['csv', 'jsonl'])
+    command.add_argument('--email', default='import@localhost',
+                         help='owner of items without a user_email')
+    command.add_argument('--batch-size', type=int, default=5000)
+    command.add_argument('--skip-existing', action='store_true',
+                         help='skip items whose name already exists')
+    command.add_argument('--defer-search-index', action='store_true',
+                         help='rebuild the search index after the import')
+    command.set_defaults(func=import_file)
+
+    command = commands.add_parser('export', help=export_file.__doc__)
+    command.add_argument('file', help="file name, or '-' for stdout")
+    command.add_argument('--format', choices=['csv', 'jsonl'])
+    command.set_defaults(func=export_file)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+    Run the Catalog web application under the gunicorn production server.
+
+    python serve.py [--bind 0.0.0.0:8000] [--workers 4] [--threads 2]
+
+    The application is imported and warmed up once in the master process,
+    before the workers are forked, so they start ready and share its
+    memory. Workers replaced after SIGHUP are forked from that same loaded
+    code and configuration, so SIGHUP only applies gunicorn's own settings.
+    To deploy changed code or config.py and settings files, send the master
+    SIGUSR2, which starts a new master, then SIGQUIT to the old one; no
+    request is dropped.
+"""
+
+from catalog import app, router, cache
+from catalog.serving import fingerprint
+from catalog.templating import compile_templates
+from catalog.views import getCategories, getLatestItems, catalogLastModified
+from gunicorn.app.base import BaseApplication
+from werkzeug.contrib.cache import SimpleCache
+import argparse
+import os
+import sys
+
+
+def warm_up():
+    """ Compile the templates, connect to the database and fill the
+    caches, so the forked workers inherit them """
+    compile_templates(app.jinja_env)
+    for root, dirs, files in os.walk(app.static_folder):
+        for name in files:
+            fingerprint(app.static_folder,
+                        os.path.relpath(os.path.join(root, name),
+                                        app.static_folder))
+    with app.test_request_context():
+        cache.version(catalogLastModified)
+        getCategories()
+        getLatestItems()
+    # connections must not be shared with the workers
+    for engine in engines():
+        engine.dispose()
+
+
+def post_fork(server, worker):
+    """ Give the worker connection pools of its own """
+    for engine in engines():
+        engine.dispose()
+
+
+def engines():
+    """ Return the database engines of the catalog and of the sessions """
+    return router.engines + app.session_interface.engines
+
+
+class CatalogServer(BaseApplication):
+    """ gunicorn application serving the catalog app """
+
+    def __init__(self, options):
+        self.options = options
+        super(CatalogServer, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # with preload_app this runs once, in the master
+        warm_up()
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default=app.config['SERVER_BIND'])
+    parser.add_argument('--workers', type=int,
+                        default=app.config['SERVER_WORKERS'])
+    parser.add_argument('--threads', type=int,
+                        default=app.config['SERVER_THREADS'])
+    args = parser.parse_args()
+
+    if args.workers > 1 and isinstance(cache.backend, SimpleCache):
+        # a write clears the cache of the worker serving it only
+        sys.stderr.write(
+            'Warning: CACHE_TYPE %r keeps a cache in every worker, so '
+            'after a write the other workers serve stale pages for up to '
+            '%d seconds. Use a shared cache such as redis.\n' % (
+                app.config['CACHE_TYPE'], app.config['CACHE_DEFAULT_TIMEOUT']))
+
+    CatalogServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'timeout': app.config['SERVER_TIMEOUT'],
+        'graceful_timeout': app.config['SERVER_GRACEFUL_TIMEOUT'],
+        'max_requests': app.config['SERVER_MAX_REQUESTS'],
+        'max_requests_jitter': app.config['SERVER_MAX_REQUESTS'] // 10,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
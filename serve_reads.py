@@ -0,0 +1,41 @@
+"""
+    Serve the read-only API with gevent, many clients in one process.
+
+    python serve_reads.py [--bind 0.0.0.0:8001] [--threads 10]
+
+    Every client connection is handled by a greenlet, so thousands of
+    kept-alive connections cost little memory, and the queries run in a
+    pool of threads. Only the paths under READ_API_PREFIX are served; put
+    this server behind the same front end as serve.py.
+"""
+
+from catalog import app, read_api
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from werkzeug.exceptions import NotFound
+from werkzeug.wsgi import DispatcherMiddleware
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip(),
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default=app.config['READ_API_BIND'])
+    parser.add_argument('--threads', type=int,
+                        default=app.config['READ_API_THREADS'])
+    parser.add_argument('--max-connections', type=int,
+                        default=app.config['READ_API_MAX_CONNECTIONS'])
+    args = parser.parse_args()
+
+    host, port = args.bind.rsplit(':', 1)
+    read_api.use_threadpool(args.threads)
+    server = WSGIServer((host, int(port)),
+                        DispatcherMiddleware(NotFound(), {
+                            app.config['READ_API_PREFIX']: read_api}),
+                        spawn=Pool(args.max_connections), log=None)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+    Tests of the catalog.
+
+    python -m unittest discover
+
+    The application reads its settings when first imported, so they are
+    pointed at a temporary folder before any test imports it.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+
+# Settings written for the tested application
+SETTINGS = """
+DATABASE_URI = 'sqlite:///%(folder)s/catalog.db'
+SESSION_DATABASE_URI = 'sqlite:///%(folder)s/sessions.db'
+TEMPLATE_CACHE_FOLDER = None
+UPLOAD_FOLDER = '%(folder)s/uploads'
+UPLOAD_QUARANTINE_FOLDER = '%(folder)s/quarantine'
+UPLOAD_SWEEP_INTERVAL = 0
+CACHE_TYPE = 'null'
+"""
+
+folder = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, folder, True)
+settings = os.path.join(folder, 'settings.py')
+with open(settings, 'w') as f:
+    f.write(SETTINGS % {'folder': folder})
+os.environ['CATALOG_SETTINGS'] = settings
@@ -0,0 +1,68 @@
+from tests import folder
+from catalog import app, migrations, search
+from catalog.database import make_engine
+from catalog.models import Item
+from catalog.pagination import keyset_page
+from sqlalchemy.orm import sessionmaker
+import os
+import shutil
+import unittest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class UndatedItemTest(unittest.TestCase):
+    """ Items saved without a publication date, before the migration
+    requiring one """
+
+    def setUp(self):
+        path = os.path.join(folder, 'pagination.db')
+        shutil.copy(os.path.join(ROOT, 'catalog.db'), path)
+        self.engine = make_engine(app.config, 'sqlite:///' + path)
+        self.engine.execute(
+            'INSERT INTO item (name, description, pub_date, category_id, '
+            'user_id) SELECT ?, ?, NULL, category_id, user_id FROM item '
+            'LIMIT 1', 'Undated', 'Saved without a date')
+        migrations.upgrade(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        os.remove(os.path.join(folder, 'pagination.db'))
+
+    def test_dated_as_unknown_and_required(self):
+        pub_date = self.session.query(Item.pub_date) \
+            .filter_by(name='Undated').scalar()
+        self.assertEqual(pub_date.year, 1970)
+        self.assertTrue(migrations.column_info(
+            self.engine, 'item', 'pub_date').notnull)
+
+    def test_listed_last_by_every_page(self):
+        query = self.session.query(Item.name, Item.pub_date, Item.id)
+        names = []
+        page = keyset_page(query, Item.pub_date, Item.id, 2)
+        while True:
+            names.extend(row.name for row in page.rows)
+            if page.next is None:
+                break
+            page = keyset_page(query, Item.pub_date, Item.id, 2,
+                               after=page.next)
+        self.assertEqual(len(names), query.count())
+        self.assertEqual(names[-1], 'Undated')
+        # and back again from the last page
+        last = len(page.rows)
+        page = keyset_page(query, Item.pub_date, Item.id, 2,
+                           before=page.prev)
+        self.assertEqual([row.name for row in page.rows],
+                         names[-last - 2:-last])
+
+    def test_still_searchable(self):
+        results, more = search.search_items(self.session, 'undated', 10)
+        self.assertEqual([result['name'] for result in results],
+                         ['Undated'])
+
+
+if __name__ == '__main__':
+    unittest.main()
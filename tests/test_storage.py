@@ -0,0 +1,46 @@
+from tests import folder
+from catalog.storage import UploadStorage
+from StringIO import StringIO
+import os
+import stat
+import unittest
+
+
+class UploadStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = os.path.join(folder, 'storage')
+        os.makedirs(self.folder)
+        self.storage = UploadStorage(self.folder, 4)
+
+    def tearDown(self):
+        for path, dirs, files in os.walk(self.folder, topdown=False):
+            for name in files:
+                os.remove(os.path.join(path, name))
+            os.rmdir(path)
+
+    def mode(self, name):
+        return stat.S_IMODE(os.stat(os.path.join(self.folder, name)).st_mode)
+
+    def test_stored_file_is_readable_by_others(self):
+        name = self.storage.save(StringIO('picture'), 'picture.PNG')
+        self.assertTrue(name.endswith('.png'))
+        # the mode of any file created under the umask, not just 0600
+        self.assertEqual(self.mode(name), 0o666 & ~self.umask())
+
+    def test_identical_upload_shares_the_file(self):
+        first = self.storage.save(StringIO('same'), 'a.jpg')
+        second = self.storage.save(StringIO('same'), 'b.jpg')
+        self.assertEqual(first, second)
+        self.assertEqual(self.mode(second), 0o666 & ~self.umask())
+        # no temporary file is left behind
+        self.assertEqual(os.listdir(self.folder), [first[:2]])
+
+    def umask(self):
+        umask = os.umask(0)
+        os.umask(umask)
+        return umask
+
+
+if __name__ == '__main__':
+    unittest.main()